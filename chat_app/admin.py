@@ -1,21 +1,88 @@
 from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Q
+from django.db.models.signals import m2m_changed
 
-from chat_app.models import Thread, Message
+from chat_app import search
+from chat_app.models import Thread, ThreadParticipant, Message, UnreadCounter
+
+
+class ThreadParticipantInline(admin.TabularInline):
+    model = ThreadParticipant
+    fields = ("user", "slot")
+    raw_id_fields = ("user",)
+    extra = 2
+    max_num = 2
 
 
 @admin.register(Thread)
 class ThreadAdmin(admin.ModelAdmin):
-    list_display = ("id", "created", "updated", "get_participants")
+    list_display = ("id", "created", "updated", "last_message_at", "get_participants")
     list_filter = ("created", "updated")
+    inlines = (ThreadParticipantInline,)
+    # Denormalized from the participants and messages, kept in sync by the models
+    readonly_fields = (
+        "participant_low",
+        "participant_high",
+        "last_message",
+        "last_message_at",
+        "read_version",
+        "read_at",
+    )
 
     def get_participants(self, obj):
         return ", ".join([p.username for p in obj.participants.all()])
 
     get_participants.short_description = "Participants"
 
+    def save_formset(self, request, form, formset, change):
+        # Inline rows are saved one by one, without the m2m_changed signal that keeps
+        # the pair key and the unread counters in sync with the participants
+        thread = form.instance
+        before = set(thread.participants.values_list("pk", flat=True))
+        super().save_formset(request, form, formset, change)
+        after = set(thread.participants.values_list("pk", flat=True))
+        for action, pk_set in (
+            ("post_remove", before - after),
+            ("post_add", after - before),
+        ):
+            if pk_set:
+                m2m_changed.send(
+                    sender=ThreadParticipant,
+                    instance=thread,
+                    action=action,
+                    reverse=False,
+                    model=User,
+                    pk_set=pk_set,
+                    using=thread._state.db,
+                )
+
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ("id", "sender", "text", "created", "is_read")
     list_filter = ("is_read", "created")
     search_fields = ("text", "sender__username")
+
+    def get_search_results(self, request, queryset, search_term):
+        # The full-text index instead of LIKE '%term%' scans over all message texts,
+        # plus the messages of the senders whose username contains the term
+        if not search_term.strip():
+            return queryset, False
+        matches = search.search_messages(
+            queryset, search_term, connections[queryset.db].vendor
+        )
+        return (
+            queryset.filter(
+                Q(pk__in=matches.values("pk"))
+                | Q(sender__username__icontains=search_term.strip())
+            ),
+            False,
+        )
+
+
+@admin.register(UnreadCounter)
+class UnreadCounterAdmin(admin.ModelAdmin):
+    list_display = ("id", "thread", "user", "count")
+    raw_id_fields = ("thread", "user")
@@ -1,6 +1,29 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import post_delete, post_migrate, post_save
+
+from chat_app import search
+
+
+def install_search_index(sender, using, **kwargs):
+    # Also sent after migrating back before the migration that installs the index
+    connection = connections[using]
+    applied = MigrationRecorder(connection).applied_migrations()
+    if ("chat_app", "0009_message_search") in applied:
+        search.install(connection)
 
 
 class ChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chat_app"
+
+    def ready(self):
+        post_migrate.connect(install_search_index, sender=self)
+
+        # Imported here, it needs the models of the installed apps
+        from chat_app.authentication import forget_cached_user
+
+        post_save.connect(forget_cached_user, sender=settings.AUTH_USER_MODEL)
+        post_delete.connect(forget_cached_user, sender=settings.AUTH_USER_MODEL)
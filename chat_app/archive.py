@@ -0,0 +1,74 @@
+"""
+Newline-delimited JSON archives of the chat data, written by the export_chat and read
+by the import_chat command.
+
+Every line is one row, {"type": "message", "id": 1, ...} with the columns of FIELDS.
+The types follow each other in the order of FIELDS, so the rows a row refers to are
+always above it. Every user a row refers to is archived, by username only, import_chat
+matches them by username in the target database. Paths ending in .gz are gzip compressed.
+"""
+
+import datetime
+import gzip
+import json
+
+from django.contrib.auth.models import User
+
+from chat_app.models import Thread, ThreadParticipant, Message
+
+FIELDS = {
+    "user": ("id", "username"),
+    "thread": (
+        "id",
+        "participant_low_id",
+        "participant_high_id",
+        "created",
+        "updated",
+        "last_message_id",
+        "last_message_at",
+        "read_version",
+        "read_at",
+    ),
+    "participant": ("thread_id", "user_id", "slot"),
+    "message": (
+        "id",
+        "thread_id",
+        "sender_id",
+        "text",
+        "created",
+        "is_read",
+        "client_id",
+    ),
+}
+
+MODELS = {
+    "user": User,
+    "thread": Thread,
+    "participant": ThreadParticipant,
+    "message": Message,
+}
+
+# Columns that hold user ids, mapped to the ids of the target database on import
+USER_FIELDS = {
+    "thread": ("participant_low_id", "participant_high_id"),
+    "participant": ("user_id",),
+    "message": ("sender_id",),
+}
+
+
+def open_archive(path, mode):
+    # Text mode, mode is "r" or "w"
+    if str(path).endswith(".gz"):
+        return gzip.open(path, f"{mode}t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def default(value):
+    # Full microseconds, DjangoJSONEncoder cuts datetimes to milliseconds
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dump_row(row_type, row):
+    return json.dumps({"type": row_type, **row}, default=default) + "\n"
@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+# Claim added to the tokens by chat_app.serializers.TokenObtainSlidingSerializer
+USERNAME_CLAIM = "username"
+
+
+def user_cache_key(user_id):
+    return f"chat:user:{user_id}"
+
+
+def forget_cached_user(sender, instance, **kwargs):
+    # Connected to the user saves and deletes, see ChatConfig.ready()
+    cache.delete(user_cache_key(instance.pk))
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that loads the user row at most once per
+    CHAT_AUTH_USER_CACHE_TIMEOUT seconds.
+
+    The loaded user is cached, a user that is deleted or deactivated is rejected with
+    401 once the cached entry is gone (right away in the process that saved it). With a
+    timeout of 0 the user is loaded on every request.
+
+    CHAT_AUTH_STATELESS opts out of loading the user: request.user is a User built from
+    the id and username claims of the token, its other fields are deferred and loaded
+    by Django when they are first accessed (e.g. is_staff by IsAdminUser). Deleting or
+    deactivating a user then does not invalidate the tokens that are already issued.
+    Tokens without the username claim always load the user.
+    """
+
+    def get_user(self, validated_token):
+        if (
+            settings.CHAT_AUTH_STATELESS
+            and jwt_settings.USER_ID_CLAIM in validated_token
+            and USERNAME_CLAIM in validated_token
+        ):
+            return self.get_token_user(validated_token)
+
+        timeout = settings.CHAT_AUTH_USER_CACHE_TIMEOUT
+        if not timeout:
+            return super().get_user(validated_token)
+        key = user_cache_key(validated_token.get(jwt_settings.USER_ID_CLAIM))
+        user = cache.get(key)
+        if user is None:
+            # Raises AuthenticationFailed for missing and inactive users
+            user = super().get_user(validated_token)
+            cache.set(key, user, timeout)
+        return user
+
+    def get_token_user(self, validated_token):
+        user_model = get_user_model()
+        # Values in the order of the model fields, the primary key comes first
+        return user_model.from_db(
+            DEFAULT_DB_ALIAS,
+            [jwt_settings.USER_ID_FIELD, user_model.USERNAME_FIELD],
+            [
+                validated_token[jwt_settings.USER_ID_CLAIM],
+                validated_token[USERNAME_CLAIM],
+            ],
+        )
+
+
+def authenticate_token(raw_token):
+    """
+    Return the user of a raw JWT, or None if the token is not valid.
+
+    Uses the JWT authentication classes configured for the API, for connections
+    that do not go through DRF views, like WebSockets.
+    """
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        authenticator = authentication_class()
+        if not hasattr(authenticator, "get_validated_token"):
+            continue
+        try:
+            return authenticator.get_user(authenticator.get_validated_token(raw_token))
+        except AuthenticationFailed:
+            return None
+    return None
+
+
+def authenticate_request(request):
+    """
+    Return the user authenticated by the API authentication classes, or None.
+
+    For plain Django views (like async views) that are not DRF views.
+    """
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        if result is not None:
+            return result[0]
+    return None
@@ -0,0 +1,25 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def response_etag(request, versions):
+    """
+    Return the ETag of a response for the request user, a digest of the URL and of
+    versions of the data in the response.
+
+    The ETag changes whenever one of the versions does, so it is also the cache key of
+    the response data. Older entries are never read again and expire.
+    """
+    # The absolute URL, pagination links in the response contain the host
+    source = f"{request.user.pk}:{request.build_absolute_uri()}:{versions}"
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+def get_page(etag):
+    return cache.get(f"chat:page:{etag}")
+
+
+def set_page(etag, data):
+    cache.set(f"chat:page:{etag}", data, timeout=settings.CHAT_CACHE_TIMEOUT)
@@ -0,0 +1,213 @@
+import asyncio
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from chat_app.models import UnreadCounter
+
+
+class BaseBroker:
+    """
+    Pub/sub layer that delivers chat events to connected clients.
+
+    publish() is called from request threads, subscribe() from the event loop that
+    serves the client connection. The broker class is configured with the
+    CHAT_EVENT_BROKER setting, so a broker backed by an external service can replace
+    the in-process one when the app runs in several processes.
+    """
+
+    def publish(self, topic, event):
+        raise NotImplementedError
+
+    def subscribe(self, topics):
+        """Return a subscription to the topics, see InMemorySubscription."""
+        raise NotImplementedError
+
+
+class InMemorySubscription:
+    # Events of a client that stops reading are dropped instead of piling up
+    max_pending = 1000
+
+    def __init__(self, broker, topics):
+        self.broker = broker
+        self.topics = list(topics)
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+    def put(self, event):
+        # Called from any thread, the queue belongs to the subscriber's event loop
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Event loop of the subscriber is already closed
+            pass
+
+    def _put(self, event):
+        if self._queue.qsize() < self.max_pending:
+            self._queue.put_nowait(event)
+
+    async def get(self):
+        return await self._queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+
+class InMemoryBroker(BaseBroker):
+    """Broker for a single process, events never leave the current process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def publish(self, topic, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(topic, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def subscribe(self, topics):
+        subscription = InMemorySubscription(self, topics)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscriptions[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscriptions.get(topic)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[topic]
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.CHAT_EVENT_BROKER)()
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    if setting == "CHAT_EVENT_BROKER":
+        get_broker.cache_clear()
+
+
+def user_topic(user_id):
+    return f"user.{user_id}"
+
+
+def publish(events):
+    """
+    Publish (user_id, event) pairs once the current transaction is committed,
+    so clients never receive events about rows they cannot read yet.
+    """
+
+    def send():
+        broker = get_broker()
+        for user_id, event in events:
+            broker.publish(user_topic(user_id), event)
+
+    transaction.on_commit(send)
+
+
+def thread_unread_counts(thread_id):
+    # Every participant has an unread counter, so one query returns both
+    # the users to notify and their current unread counts
+    return UnreadCounter.objects.filter(thread_id=thread_id).values_list(
+        "user_id", "count"
+    )
+
+
+def notify_message_created(message, data):
+    notify_messages_created(message.thread_id, message.sender_id, [data])
+
+
+def notify_messages_created(thread_id, sender_id, messages_data):
+    # One event per message, but the unread counts only once for all of them
+    events = []
+    for user_id, count in thread_unread_counts(thread_id):
+        for data in messages_data:
+            events.append(
+                (
+                    user_id,
+                    {
+                        "type": "message.created",
+                        "thread_id": thread_id,
+                        "message": data,
+                    },
+                )
+            )
+        if user_id != sender_id:
+            events.append(
+                (
+                    user_id,
+                    {
+                        "type": "unread_count",
+                        "thread_id": thread_id,
+                        "unread_count": count,
+                    },
+                )
+            )
+    publish(events)
+
+
+def notify_messages_read(thread_id, reader_id, **receipt):
+    # receipt describes what was read: a "message_id", or "up_to_id"/"up_to" of a bulk read
+    events = []
+    for user_id, count in thread_unread_counts(thread_id):
+        events.append(
+            (
+                user_id,
+                {
+                    "type": "messages.read",
+                    "thread_id": thread_id,
+                    "reader_id": reader_id,
+                    **receipt,
+                },
+            )
+        )
+        if user_id == reader_id:
+            events.append(
+                (
+                    user_id,
+                    {
+                        "type": "unread_count",
+                        "thread_id": thread_id,
+                        "unread_count": count,
+                    },
+                )
+            )
+    publish(events)
+
+
+def notify_thread_created(thread, user_ids):
+    publish(
+        [
+            (user_id, {"type": "thread.created", "thread_id": thread.id})
+            for user_id in user_ids
+        ]
+    )
+
+
+def notify_thread_deleted(thread_id, user_ids):
+    publish(
+        [
+            (user_id, {"type": "thread.deleted", "thread_id": thread_id})
+            for user_id in user_ids
+        ]
+    )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from chat_app.models import Thread, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the last message and the last activity time of the threads "
+        "from their messages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        latest_messages = Message.objects.filter(thread_id=OuterRef("pk")).order_by(
+            "-created", "-id"
+        )
+
+        updated = 0
+        last_id = 0
+        while True:
+            # Batches by primary key keep every UPDATE short on large tables
+            ids = list(
+                Thread.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                updated += Thread.objects.filter(id__in=ids).update(
+                    last_message_id=Subquery(latest_messages.values("id")[:1]),
+                    last_message_at=Coalesce(
+                        Subquery(latest_messages.values("created")[:1]), F("created")
+                    ),
+                )
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} threads."))
@@ -0,0 +1,297 @@
+import contextlib
+import json
+import math
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection
+from io import StringIO
+from urllib.parse import urlsplit
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from chat_app.models import Thread, Message
+from chat_app.serializers import TokenObtainSlidingSerializer
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile
+    rank = math.ceil(percent / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+SCENARIOS = (
+    "token",
+    "thread_create",
+    "thread_list",
+    "message_post",
+    "message_list",
+    "message_read",
+    "unread_count",
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed users, threads and messages, then load a running server with the chat API "
+        "requests and report latency percentiles, requests/sec and queries per request. "
+        "The server must use the same database as this command, run it against a "
+        "scratch database: it writes data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--threads", type=int, default=50)
+        parser.add_argument("--messages", type=int, default=5000)
+        parser.add_argument(
+            "--requests", type=int, default=500, help="Requests per scenario."
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            dest="scenarios",
+            choices=SCENARIOS,
+            help="Run only the given scenario, can be repeated.",
+        )
+        parser.add_argument(
+            "--query-samples",
+            type=int,
+            default=5,
+            help="Requests per scenario replayed in-process to count the queries.",
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+        parser.add_argument(
+            "--baseline",
+            help="JSON file of an earlier run to compare the results with.",
+        )
+
+    def handle(self, *args, **options):
+        if options["threads"] > options["users"] * (options["users"] - 1) // 2:
+            raise CommandError("Not enough users for the number of threads.")
+
+        self.rng = random.Random(42)
+        self.seed(options)
+
+        results = {}
+        for scenario in options["scenarios"] or SCENARIOS:
+            requests = [
+                self.build_request(scenario, i) for i in range(options["requests"])
+            ]
+            results[scenario] = self.run_scenario(
+                options["url"], requests, options["concurrency"]
+            )
+            results[scenario]["queries_per_request"] = self.count_queries(
+                [
+                    self.build_request(scenario, options["requests"] + i)
+                    for i in range(options["query_samples"])
+                ]
+            )
+            self.report(scenario, results[scenario])
+
+        report = {
+            "created": timezone.now().isoformat(),
+            "url": options["url"],
+            "options": {
+                name: options[name]
+                for name in ("users", "threads", "messages", "requests", "concurrency")
+            },
+            "scenarios": results,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                self.compare(json.load(file)["scenarios"], results)
+
+    def seed(self, options):
+        started = time.perf_counter()
+        # One shared hash, hashing a password per user would dominate seeding time
+        self.password = "benchmark"
+        password = make_password(self.password)
+        prefix = f"bench_api_{int(time.time())}_"
+        users = User.objects.bulk_create(
+            [
+                User(username=f"{prefix}{i}", password=password)
+                for i in range(options["users"])
+            ]
+        )
+        # The tokens the API issues, with the username claim
+        self.tokens = {
+            user.id: f"Bearer {TokenObtainSlidingSerializer.get_token(user)}"
+            for user in users
+        }
+
+        pairs = set()
+        while len(pairs) < options["threads"]:
+            pairs.add(tuple(sorted(self.rng.sample(range(len(users)), 2))))
+        self.threads = []
+        for low, high in sorted(pairs):
+            thread, _ = Thread.objects.get_or_create_for_pair(users[low], users[high])
+            self.threads.append((thread.id, users[low], users[high]))
+
+        # bulk_create skips Message.save(), the unread counters and the last message of
+        # the threads are recomputed below
+        messages = []
+        for i in range(options["messages"]):
+            thread_id, user, other_user = self.rng.choice(self.threads)
+            messages.append(
+                Message(
+                    thread_id=thread_id,
+                    sender=self.rng.choice((user, other_user)),
+                    text=f"Benchmark message {i}",
+                )
+            )
+        Message.objects.bulk_create(messages, batch_size=1000)
+        call_command("repair_unread_counters", stdout=StringIO())
+        call_command("backfill_thread_activity", stdout=StringIO())
+
+        # Unread messages that the other participant can mark as read
+        self.unread = [
+            (thread_id, reader, message_id)
+            for thread_id, user, other_user in self.threads
+            for reader in (user, other_user)
+            for message_id in Message.objects.filter(thread_id=thread_id, is_read=False)
+            .exclude(sender=reader)
+            .values_list("id", flat=True)
+        ]
+        self.rng.shuffle(self.unread)
+
+        self.stdout.write(
+            f"Seeded {len(users)} users, {len(self.threads)} threads and "
+            f"{len(messages)} messages in {time.perf_counter() - started:.1f}s"
+        )
+
+    def build_request(self, scenario, i):
+        """Return (method, path, body, authorization) of the i-th request of a scenario."""
+        thread_id, user, other_user = self.threads[i % len(self.threads)]
+        # Alternate the participant that sends the request on every pass over the threads
+        if i // len(self.threads) % 2:
+            user, other_user = other_user, user
+        token = self.tokens[user.id]
+        messages_path = f"/api/threads/{thread_id}/messages/"
+
+        if scenario == "token":
+            body = {"username": user.username, "password": self.password}
+            return "POST", "/api/token/", body, None
+        if scenario == "thread_create":
+            return "POST", "/api/threads/", {"username": other_user.username}, token
+        if scenario == "thread_list":
+            return "GET", "/api/threads/", None, token
+        if scenario == "message_post":
+            return "POST", messages_path, {"text": f"Load test message {i}"}, token
+        if scenario == "message_list":
+            return "GET", messages_path, None, token
+        if scenario == "message_read":
+            if not self.unread:
+                raise CommandError("No unread messages to mark as read, seed more.")
+            thread_id, reader, message_id = self.unread[i % len(self.unread)]
+            path = f"/api/threads/{thread_id}/messages/{message_id}/"
+            return "PATCH", path, {"is_read": True}, self.tokens[reader.id]
+        if scenario == "unread_count":
+            return "GET", f"{messages_path}unread_count/", None, token
+        raise ValueError(scenario)
+
+    def run_scenario(self, url, requests, concurrency):
+        parts = urlsplit(url)
+        connection_class = (
+            HTTPSConnection if parts.scheme == "https" else HTTPConnection
+        )
+        # One keep-alive connection per worker thread, like a client pool would do
+        local = threading.local()
+
+        def send(request):
+            method, path, body, authorization = request
+            headers = {"Content-Type": "application/json"}
+            if authorization:
+                headers["Authorization"] = authorization
+            if not hasattr(local, "connection"):
+                local.connection = connection_class(parts.netloc, timeout=60)
+            started = time.perf_counter()
+            try:
+                local.connection.request(
+                    method,
+                    parts.path.rstrip("/") + path,
+                    body=json.dumps(body) if body is not None else None,
+                    headers=headers,
+                )
+                response = local.connection.getresponse()
+                response.read()
+                status = response.status
+            except OSError:
+                local.connection.close()
+                del local.connection
+                status = None
+            return (time.perf_counter() - started) * 1000, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            responses = list(executor.map(send, requests))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for latency, _ in responses)
+        return {
+            "requests": len(responses),
+            "errors": sum(status is None or status >= 400 for _, status in responses),
+            "requests_per_second": round(len(responses) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+        }
+
+    def count_queries(self, requests):
+        # Queries of all database aliases, list endpoints may read from a replica
+        client = Client()
+        counts = []
+        for method, path, body, authorization in requests:
+            with contextlib.ExitStack() as stack:
+                contexts = [
+                    stack.enter_context(CaptureQueriesContext(connection))
+                    for connection in connections.all()
+                ]
+                client.generic(
+                    method,
+                    path,
+                    json.dumps(body) if body is not None else "",
+                    content_type="application/json",
+                    headers={"Authorization": authorization} if authorization else {},
+                )
+            counts.append(sum(len(context) for context in contexts))
+        return round(statistics.mean(counts), 1) if counts else None
+
+    def report(self, scenario, result):
+        self.stdout.write(self.style.SUCCESS(scenario))
+        self.stdout.write(
+            f"{result['requests_per_second']} req/s, p50 {result['p50_ms']} ms, "
+            f"p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+            f"{result['queries_per_request']} queries/request, "
+            f"{result['errors']} errors"
+        )
+
+    def compare(self, baseline, results):
+        self.stdout.write(
+            self.style.MIGRATE_HEADING("\n=== compared with baseline ===")
+        )
+        for scenario, result in results.items():
+            if scenario not in baseline:
+                continue
+            changes = []
+            for key in ("requests_per_second", "p95_ms", "queries_per_request"):
+                before, after = baseline[scenario].get(key), result[key]
+                if before:
+                    changes.append(
+                        f"{key} {before} -> {after} ({after / before - 1:+.0%})"
+                    )
+            self.stdout.write(f"{scenario}: " + ", ".join(changes))
@@ -0,0 +1,171 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+
+from chat_app.models import Thread, ThreadParticipant, Message
+from chat_app.serializers import MessageRowSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a database with chat data and compare query plans and timings of the hot "
+        "message queries with and without the Message indexes. "
+        "Run it against a scratch database: it writes data and drops/re-creates indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--threads", type=int, default=1000)
+        parser.add_argument("--messages", type=int, default=2_000_000)
+        parser.add_argument(
+            "--hot-share",
+            type=float,
+            default=0.5,
+            help="Share of all messages that goes to one 'hot' thread.",
+        )
+        parser.add_argument("--unread-share", type=float, default=0.05)
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--no-seed",
+            action="store_true",
+            help="Benchmark the data that is already in the database.",
+        )
+        parser.add_argument(
+            "--skip-baseline",
+            action="store_true",
+            help="Do not drop the indexes to measure the unindexed baseline.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["no_seed"]:
+            self.seed(options)
+
+        # The thread with the longest history is the worst case for both queries
+        thread = (
+            Thread.objects.annotate(total=Count("messages"))
+            .filter(total__gt=0)
+            .order_by("-total")
+            .first()
+        )
+        if thread is None:
+            self.stderr.write("No messages to benchmark, run without --no-seed.")
+            return
+        user = thread.participants.first()
+        queries = self.hot_queries(thread, user)
+
+        if not options["skip_baseline"]:
+            with connection.schema_editor() as schema_editor:
+                for index in Message._meta.indexes:
+                    schema_editor.remove_index(Message, index)
+            try:
+                self.run_phase("without indexes", queries, options["repeat"])
+            finally:
+                with connection.schema_editor() as schema_editor:
+                    for index in Message._meta.indexes:
+                        schema_editor.add_index(Message, index)
+
+        self.run_phase("with indexes", queries, options["repeat"])
+
+    def seed(self, options):
+        rng = random.Random(42)
+        batch_size = options["batch_size"]
+        started = time.perf_counter()
+
+        # One shared hash, hashing a password per user would dominate seeding time
+        password = make_password("benchmark")
+        prefix = f"bench_{int(time.time())}_"
+        users = User.objects.bulk_create(
+            [
+                User(username=f"{prefix}{i}", password=password)
+                for i in range(options["users"])
+            ],
+            batch_size=batch_size,
+        )
+        user_ids = [user.id for user in users]
+
+        with transaction.atomic():
+            threads = Thread.objects.bulk_create(
+                [Thread() for _ in range(options["threads"])], batch_size=batch_size
+            )
+
+            pairs = {}
+            participant_rows = []
+            for thread in threads:
+                pair = rng.sample(user_ids, 2)
+                pairs[thread.id] = pair
+                participant_rows.extend(
+                    ThreadParticipant(thread_id=thread.id, user_id=user_id, slot=slot)
+                    for slot, user_id in enumerate(pair)
+                )
+            ThreadParticipant.objects.bulk_create(
+                participant_rows, batch_size=batch_size
+            )
+
+        hot_thread_id = threads[0].id
+        hot_messages = int(options["messages"] * options["hot_share"])
+        thread_ids = [thread.id for thread in threads]
+
+        batch = []
+        for i in range(options["messages"]):
+            thread_id = hot_thread_id if i < hot_messages else rng.choice(thread_ids)
+            batch.append(
+                Message(
+                    thread_id=thread_id,
+                    sender_id=rng.choice(pairs[thread_id]),
+                    text=f"Benchmark message {i}",
+                    is_read=rng.random() >= options["unread_share"],
+                )
+            )
+            if len(batch) >= batch_size:
+                # bulk_create skips Message.save(), participants are valid by construction
+                Message.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Message.objects.bulk_create(batch)
+
+        self.stdout.write(
+            f"Seeded {options['users']} users, {options['threads']} threads and "
+            f"{options['messages']} messages in {time.perf_counter() - started:.1f}s"
+        )
+
+    def hot_queries(self, thread, user):
+        # The message list is the queryset of ThreadMessageViewSet.list, the unread count
+        # is what repair_unread_counters recomputes for every participant
+        messages = Message.objects.filter(
+            thread_id=thread.id, thread__participants=user
+        ).values(*MessageRowSerializer.values_fields)
+        return {
+            "messages first page": messages[:10],
+            "messages page at offset 10000": messages[10_000:10_010],
+            # count() drops the default ordering, do the same so explain() shows the real plan
+            "unread count": Message.objects.filter(thread_id=thread.id, is_read=False)
+            .exclude(sender=user)
+            .order_by(),
+        }
+
+    def run_phase(self, title, queries, repeat):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n=== {title} ==="))
+        for name, queryset in queries.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if name == "unread count":
+                    queryset.count()
+                else:
+                    list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+
+            self.stdout.write(self.style.SUCCESS(name))
+            self.stdout.write(queryset.explain())
+            self.stdout.write(
+                f"median {statistics.median(timings):.2f} ms, "
+                f"min {min(timings):.2f} ms, max {max(timings):.2f} ms "
+                f"({repeat} runs)\n"
+            )
@@ -0,0 +1,102 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chat_app import search
+from chat_app.models import Thread, Message
+
+# Word frequencies of the seeded texts fall off like in real chat: a few words are in
+# most messages, most words are rare. Same width, so no word is a part of another one
+# for LIKE
+VOCABULARY = [f"word{i:04}" for i in range(5000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the milliseconds of searching the message texts with LIKE '%word%' "
+        "(icontains) and with the full-text index, for a rare word, a common word and "
+        "two words. The messages are seeded in a transaction that is rolled back at the "
+        "end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        terms = {
+            "rare word": VOCABULARY[-1],
+            "common word": VOCABULARY[0],
+            "two words": f"{VOCABULARY[1]} {VOCABULARY[2]}",
+        }
+        with transaction.atomic():
+            user = self.seed(options["messages"])
+            messages = Message.objects.filter(thread__participants=user)
+            paths = {
+                "icontains": lambda term: search.search_messages(
+                    messages, term, vendor=None
+                ),
+                "full-text index": lambda term: search.search_messages(
+                    messages, term, connection.vendor
+                ),
+            }
+
+            results = {}
+            for name, path in paths.items():
+                for label, term in terms.items():
+                    results[name, label] = self.measure(path(term), options["repeat"])
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(
+                f"\n=== {options['messages']:,} messages, ms (matches) ==="
+            )
+        )
+        for name in paths:
+            self.stdout.write(self.style.SUCCESS(name))
+            for label in terms:
+                ms, count = results[name, label]
+                self.stdout.write(f"{label}: {ms:.1f} ms ({count:,})")
+        self.stdout.write("")
+        for label in terms:
+            before, _ = results["icontains", label]
+            after, _ = results["full-text index", label]
+            self.stdout.write(f"{label}: the index is {before / after:.1f}x faster")
+
+    def seed(self, count):
+        password = make_password("benchmark")
+        prefix = f"bench_search_{int(time.time())}_"
+        user, other_user = User.objects.bulk_create(
+            [User(username=f"{prefix}{i}", password=password) for i in range(2)]
+        )
+        thread, _ = Thread.objects.get_or_create_for_pair(user, other_user)
+        rng = random.Random(0)
+        # bulk_create skips Message.save(), the counters are not needed here. The
+        # triggers index the texts
+        Message.objects.bulk_create(
+            [
+                Message(
+                    thread=thread,
+                    sender=(user, other_user)[i % 2],
+                    text=" ".join(rng.choices(VOCABULARY, WEIGHTS, k=12)),
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+        return user
+
+    def measure(self, queryset, repeat):
+        """Return the median ms of the first page of results and the match count."""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset.order_by("-rank", "-created", "-id")[:10])
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), queryset.count()
@@ -0,0 +1,107 @@
+import statistics
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from chat_app.models import Thread, Message
+from chat_app.serializers import ThreadMessageSerializer, MessageRowSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows/sec of dumping the messages of a thread with "
+        "ThreadMessageSerializer on model instances and with MessageRowSerializer on "
+        "values() rows, and check that both render the same JSON. The messages are "
+        "seeded in a transaction that is rolled back at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            thread = self.seed(options["messages"])
+            messages = (
+                Message.objects.select_related("sender")
+                .filter(thread=thread)
+                .order_by("-created", "-id")
+            )
+            paths = {
+                "serializer": (
+                    messages,
+                    lambda rows: ThreadMessageSerializer(rows, many=True).data,
+                ),
+                "values rows": (
+                    messages.values(*MessageRowSerializer.values_fields),
+                    lambda rows: MessageRowSerializer(rows, many=True).data,
+                ),
+            }
+
+            rendered = {}
+            results = {}
+            for name, (queryset, serialize) in paths.items():
+                rendered[name] = JSONRenderer().render(serialize(queryset.all()))
+                results[name] = self.measure(queryset, serialize, options["repeat"])
+            transaction.set_rollback(True)
+
+        count = options["messages"]
+        self.stdout.write(self.style.MIGRATE_HEADING("\n=== rows/sec ==="))
+        for name, (total, serialize_only) in results.items():
+            self.stdout.write(self.style.SUCCESS(name))
+            self.stdout.write(
+                f"fetch, serialize and render: {count / total:,.0f} rows/s "
+                f"({total * 1000:.1f} ms), serialize only: "
+                f"{count / serialize_only:,.0f} rows/s ({serialize_only * 1000:.1f} ms)"
+            )
+        (before, before_serialize), (after, after_serialize) = results.values()
+        self.stdout.write(
+            f"\nvalues rows are {before / after:.1f}x faster end to end and "
+            f"{before_serialize / after_serialize:.1f}x faster to serialize"
+        )
+        if rendered["serializer"] == rendered["values rows"]:
+            self.stdout.write("Both paths render identical JSON")
+        else:
+            self.stderr.write("The paths render different JSON")
+
+    def seed(self, count):
+        password = make_password("benchmark")
+        prefix = f"bench_serializers_{int(time.time())}_"
+        user, other_user = User.objects.bulk_create(
+            [User(username=f"{prefix}{i}", password=password) for i in range(2)]
+        )
+        thread, _ = Thread.objects.get_or_create_for_pair(user, other_user)
+        # bulk_create skips Message.save(), the counters are not needed here
+        Message.objects.bulk_create(
+            [
+                Message(
+                    thread=thread,
+                    sender=(user, other_user)[i % 2],
+                    text=f"Benchmark message {i}",
+                    is_read=i % 3 == 0,
+                )
+                for i in range(count)
+            ],
+            batch_size=1000,
+        )
+        return thread
+
+    def measure(self, queryset, serialize, repeat):
+        """Return the median seconds of the whole dump and of the serialization only."""
+        totals = []
+        serialize_only = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = list(queryset.all())
+            JSONRenderer().render(serialize(rows))
+            totals.append(time.perf_counter() - started)
+
+            # Serialization of the already fetched rows, without the rendering
+            started = time.perf_counter()
+            serialize(rows)
+            serialize_only.append(time.perf_counter() - started)
+        return statistics.median(totals), statistics.median(serialize_only)
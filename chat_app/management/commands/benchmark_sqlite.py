@@ -0,0 +1,133 @@
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError
+from django.db.utils import ConnectionHandler
+
+from my_django_chat_project.database import (
+    parse_database_url,
+    sqlite_read_only,
+    tune_sqlite,
+)
+
+LIST_QUERY = (
+    "SELECT id, thread_id, sender_id, text, created FROM message "
+    "WHERE thread_id = %s ORDER BY created DESC, id DESC LIMIT 10"
+)
+INSERT_QUERY = (
+    "INSERT INTO message (thread_id, sender_id, text, created) "
+    "VALUES (%s, %s, %s, datetime('now'))"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent read/write throughput of a SQLite file with the default "
+        "settings and with the WAL tuning and read-only connection of the settings. "
+        "Runs on temporary database files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=5)
+        parser.add_argument("--readers", type=int, default=4)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--messages", type=int, default=100_000)
+        parser.add_argument("--threads", type=int, default=100)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            for label, tuned in (("default", False), ("tuned", True)):
+                path = Path(directory) / f"{label}.sqlite3"
+                database = parse_database_url(f"sqlite:///{path}")
+                # Same configuration as DATABASE_SQLITE_TUNING and
+                # DATABASE_SQLITE_READ_REPLICA in settings
+                writer = tune_sqlite(database) if tuned else database
+                reader = sqlite_read_only(writer) if tuned else writer
+                # Own aliases, ConnectionHandler only insists on a "default" one
+                connections = ConnectionHandler(
+                    {"default": writer, "writer": writer, "reader": reader}
+                )
+                self.seed(connections["writer"], options)
+                results = self.run_phase(connections, options)
+                connections.close_all()
+
+                self.stdout.write(self.style.SUCCESS(label))
+                self.stdout.write(
+                    f"reads {results['reads'] / options['seconds']:.0f}/s, "
+                    f"writes {results['writes'] / options['seconds']:.0f}/s, "
+                    f"'database is locked' errors {results['errors']}"
+                )
+
+    def seed(self, connection, options):
+        # A table shaped like Message and its list index, so the numbers are about
+        # locking rather than about the chat_app schema
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE message (id INTEGER PRIMARY KEY, thread_id INTEGER, "
+                "sender_id INTEGER, text TEXT, created TEXT)"
+            )
+            cursor.execute(
+                "CREATE INDEX message_thread_created ON message "
+                "(thread_id, created DESC, id DESC)"
+            )
+            cursor.executemany(
+                INSERT_QUERY,
+                [
+                    (i % options["threads"], i % 7, f"Benchmark message {i}")
+                    for i in range(options["messages"])
+                ],
+            )
+        connection.close()
+
+    def run_phase(self, connections, options):
+        results = {"reads": 0, "writes": 0, "errors": 0}
+        failures = []
+        lock = threading.Lock()
+        deadline = time.monotonic() + options["seconds"]
+
+        def read(cursor, i):
+            cursor.execute(LIST_QUERY, [i % options["threads"]])
+            cursor.fetchall()
+
+        def write(cursor, i):
+            cursor.execute(
+                INSERT_QUERY, [i % options["threads"], 1, f"New message {i}"]
+            )
+
+        def worker(alias, operation, key):
+            # ConnectionHandler keeps one connection per thread
+            connection = connections[alias]
+            done = errors = 0
+            try:
+                with connection.cursor() as cursor:
+                    while time.monotonic() < deadline:
+                        try:
+                            operation(cursor, done)
+                            done += 1
+                        except OperationalError:
+                            errors += 1
+            except Exception as error:
+                failures.append(error)
+            finally:
+                connection.close()
+            with lock:
+                results[key] += done
+                results["errors"] += errors
+
+        workers = [
+            threading.Thread(target=worker, args=("reader", read, "reads"))
+            for _ in range(options["readers"])
+        ] + [
+            threading.Thread(target=worker, args=("writer", write, "writes"))
+            for _ in range(options["writers"])
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        if failures:
+            raise failures[0]
+        return results
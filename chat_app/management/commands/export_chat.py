@@ -0,0 +1,57 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Q
+
+from chat_app.archive import FIELDS, MODELS, USER_FIELDS, dump_row, open_archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the threads, their participants and messages (and the usernames of the "
+        "users they refer to) to a newline-delimited JSON file, gzip compressed if the path "
+        "ends in .gz. Rows are streamed, memory use does not depend on the data size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        querysets = {
+            row_type: model.objects.order_by("pk") for row_type, model in MODELS.items()
+        }
+        # Every user a row refers to, e.g. the sender of a message may have left the
+        # thread since
+        referenced = Q()
+        for row_type, names in USER_FIELDS.items():
+            for name in names:
+                referenced |= Exists(
+                    MODELS[row_type].objects.filter(**{name: OuterRef("pk")})
+                )
+        querysets["user"] = User.objects.filter(referenced).order_by("pk")
+
+        counts = {}
+        started = time.perf_counter()
+        with open_archive(options["path"], "w") as archive:
+            for row_type, queryset in querysets.items():
+                counts[row_type] = 0
+                # values() rows fetched in chunks instead of the whole table at once
+                for row in queryset.values(*FIELDS[row_type]).iterator(
+                    chunk_size=options["chunk_size"]
+                ):
+                    archive.write(dump_row(row_type, row))
+                    counts[row_type] += 1
+        elapsed = time.perf_counter() - started
+
+        total = sum(counts.values())
+        summary = ", ".join(
+            f"{count} {row_type}s" for row_type, count in counts.items()
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {summary} in {elapsed:.2f} s "
+                f"({total / elapsed:,.0f} rows/s)."
+            )
+        )
@@ -0,0 +1,159 @@
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from chat_app.archive import MODELS, USER_FIELDS, open_archive
+from chat_app.models import Thread, Message
+
+
+@contextmanager
+def keep_timestamps(*models):
+    # bulk_create() sets auto_now and auto_now_add fields to the current time, the
+    # archived times are kept instead while the rows are inserted
+    fields = [
+        field
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a file written by export_chat (gzip compressed if the path ends in .gz) "
+        "into a database without threads and messages. Rows are streamed and inserted "
+        "in batches, the ids of threads and messages are kept. Users are matched by "
+        "username, missing ones are created without a usable password."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if Thread.objects.exists() or Message.objects.exists():
+            raise CommandError(
+                "The database already has threads or messages, import_chat only "
+                "loads into an empty chat database."
+            )
+
+        # Archived user id -> id of the user in this database
+        self.user_ids = {}
+        counts = Counter()
+        started = time.perf_counter()
+        # One transaction, a failed import leaves nothing behind. The foreign keys are
+        # checked at the commit, so a thread may refer to its last message before the
+        # message row is inserted.
+        with transaction.atomic(), keep_timestamps(Thread, Message):
+            with open_archive(options["path"], "r") as archive:
+                batch_type, batch = None, []
+                for line in archive:
+                    row = json.loads(line)
+                    row_type = row.pop("type")
+                    if row_type not in MODELS:
+                        raise CommandError(f"Unknown row type {row_type!r}.")
+                    if row_type != batch_type or len(batch) >= options["batch_size"]:
+                        self.insert(batch_type, batch)
+                        counts[batch_type] += len(batch)
+                        batch_type, batch = row_type, []
+                    batch.append(row)
+                self.insert(batch_type, batch)
+                counts[batch_type] += len(batch)
+
+            # Explicit ids do not advance the id sequences of PostgreSQL
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                    no_style(), [Thread, Message]
+                ):
+                    cursor.execute(sql)
+            # The counters are not archived, they are computed from the messages
+            call_command("repair_unread_counters", stdout=self.stdout)
+        elapsed = time.perf_counter() - started
+
+        total = sum(counts.values())
+        summary = ", ".join(f"{counts[row_type]} {row_type}s" for row_type in MODELS)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {summary} in {elapsed:.2f} s "
+                f"({total / elapsed:,.0f} rows/s)."
+            )
+        )
+
+    def insert(self, row_type, rows):
+        if not rows:
+            return
+        if row_type == "user":
+            self.insert_users(rows)
+            return
+        for name in USER_FIELDS[row_type]:
+            for row in rows:
+                if row[name] is None:
+                    continue
+                if row[name] not in self.user_ids:
+                    raise CommandError(
+                        f"Unknown user id {row[name]} in the {name} of a {row_type} "
+                        "row, the archive has no user row with that id."
+                    )
+                row[name] = self.user_ids[row[name]]
+        if row_type == "thread":
+            self.sort_pairs(rows)
+        elif row_type == "participant":
+            self.assign_slots(rows)
+        model = MODELS[row_type]
+        # bulk_create() skips save() and the signals, e.g. Message.save() would count
+        # every message as unread and make it the last message of its thread
+        model.objects.bulk_create([model(**row) for row in rows])
+
+    def sort_pairs(self, rows):
+        # Users may get ids in another order in this database, the pair key is the
+        # lower and the higher id again, or get_or_create_for_pair() would not find it
+        for row in rows:
+            if row["participant_low_id"] is not None:
+                row["participant_low_id"], row["participant_high_id"] = sorted(
+                    [row["participant_low_id"], row["participant_high_id"]]
+                )
+
+    def assign_slots(self, rows):
+        # The lower id takes slot 0, like in get_or_create_for_pair(). The threads are
+        # already inserted, they come before the participants in the archive.
+        low_ids = dict(
+            Thread.objects.filter(
+                pk__in={row["thread_id"] for row in rows}
+            ).values_list("pk", "participant_low_id")
+        )
+        for row in rows:
+            low_id = low_ids.get(row["thread_id"])
+            if low_id is not None:
+                row["slot"] = 0 if row["user_id"] == low_id else 1
+
+    def insert_users(self, rows):
+        ids = dict(
+            User.objects.filter(
+                username__in=[row["username"] for row in rows]
+            ).values_list("username", "id")
+        )
+        missing = [
+            User(username=row["username"], password=make_password(None))
+            for row in rows
+            if row["username"] not in ids
+        ]
+        User.objects.bulk_create(missing)
+        ids.update((user.username, user.id) for user in missing)
+        for row in rows:
+            self.user_ids[row["id"]] = ids[row["username"]]
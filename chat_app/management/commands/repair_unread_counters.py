@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from chat_app.models import ThreadParticipant, Message, UnreadCounter
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-participant unread counters from the messages, "
+        "writing only the counters that have drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--thread",
+            type=int,
+            action="append",
+            dest="thread_ids",
+            help="Limit the repair to the given thread id, can be repeated.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        participants = ThreadParticipant.objects.all()
+        counters = UnreadCounter.objects.all()
+        if options["thread_ids"]:
+            participants = participants.filter(thread_id__in=options["thread_ids"])
+            counters = counters.filter(thread_id__in=options["thread_ids"])
+
+        unread = (
+            Message.objects.filter(thread_id=OuterRef("thread_id"), is_read=False)
+            .exclude(sender_id=OuterRef("user_id"))
+            .order_by()
+            .values("thread_id")
+            .annotate(total=Count("id"))
+            .values("total")
+        )
+        stored = UnreadCounter.objects.filter(
+            thread_id=OuterRef("thread_id"), user_id=OuterRef("user_id")
+        ).values("count")
+
+        # Compare the stored counters with the real number of unread messages in the
+        # database and only bring back the rows that differ (or are missing)
+        drifted = (
+            participants.annotate(
+                unread=Coalesce(Subquery(unread), 0), stored=Subquery(stored)
+            )
+            .filter(Q(stored__isnull=True) | ~Q(stored=F("unread")))
+            .values_list("thread_id", "user_id", "unread")
+            .order_by("thread_id", "user_id")
+        )
+
+        # Walk the participants in keyset batches instead of keeping one cursor open
+        # while the counters table is being written
+        repaired = 0
+        last_thread_id, last_user_id = 0, 0
+        while True:
+            rows = list(
+                drifted.filter(
+                    Q(thread_id__gt=last_thread_id)
+                    | Q(thread_id=last_thread_id, user_id__gt=last_user_id)
+                )[:batch_size]
+            )
+            if not rows:
+                break
+            with transaction.atomic():
+                UnreadCounter.objects.bulk_create(
+                    [
+                        UnreadCounter(thread_id=thread_id, user_id=user_id, count=count)
+                        for thread_id, user_id, count in rows
+                    ],
+                    update_conflicts=True,
+                    unique_fields=["thread", "user"],
+                    update_fields=["count"],
+                )
+            repaired += len(rows)
+            last_thread_id, last_user_id, _ = rows[-1]
+
+        # Counters of users that are not participants of the thread anymore
+        stale, _ = counters.exclude(
+            Exists(
+                ThreadParticipant.objects.filter(
+                    thread_id=OuterRef("thread_id"), user_id=OuterRef("user_id")
+                )
+            )
+        ).delete()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Repaired {repaired} unread counters, removed {stale} stale counters."
+            )
+        )
@@ -0,0 +1,226 @@
+import contextlib
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        # Nested serializers run inside their parent, only the outermost one is timed
+        self.serializer_depth = 0
+
+    def server_timing(self, total):
+        return ", ".join(
+            [
+                f'db;desc="{self.db_queries} queries";dur={self.db_time * 1000:.2f}',
+                f"serializer;dur={self.serializer_time * 1000:.2f}",
+                f"total;dur={total * 1000:.2f}",
+            ]
+        )
+
+
+# Metrics of the current request. Context variables are copied into the threads that
+# run sync code for async requests, so queries made there are recorded as well.
+request_metrics = ContextVar("request_metrics", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = request_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def add_query_recorder(sender=None, connection=None, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextlib.contextmanager
+def serializer_timer():
+    metrics = request_metrics.get()
+    if metrics is None or metrics.serializer_depth:
+        yield
+        return
+    metrics.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_time += time.perf_counter() - started
+        metrics.serializer_depth -= 1
+
+
+class TimedSerializerMixin:
+    """Adds the time spent validating and representing data to the request metrics."""
+
+    def run_validation(self, *args, **kwargs):
+        with serializer_timer():
+            return super().run_validation(*args, **kwargs)
+
+    def to_representation(self, instance):
+        with serializer_timer():
+            return super().to_representation(instance)
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # labels -> counts per bucket, sum and count of the observed values
+        self.samples = {}
+
+    def observe(self, labels, value):
+        sample = self.samples.setdefault(labels, [[0] * len(self.buckets), 0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                sample[0][i] += 1
+        sample[1] += value
+        sample[2] += 1
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labels, (bucket_counts, total, count) in sorted(self.samples.items()):
+            label_text = ",".join(
+                f'{name}="{escape_label(value)}"' for name, value in labels
+            )
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(
+                    f'{self.name}_bucket{{{label_text},le="{bound}"}} {bucket_count}'
+                )
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return lines
+
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Per-route histograms of the requests served by this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {
+                "total": Histogram(
+                    "chat_request_duration_seconds",
+                    "Total time of the request.",
+                    DURATION_BUCKETS,
+                ),
+                "db": Histogram(
+                    "chat_request_db_duration_seconds",
+                    "Time spent in database queries.",
+                    DURATION_BUCKETS,
+                ),
+                "serializer": Histogram(
+                    "chat_request_serializer_duration_seconds",
+                    "Time spent in serializers, including the queries they made.",
+                    DURATION_BUCKETS,
+                ),
+                "queries": Histogram(
+                    "chat_request_db_queries",
+                    "Number of database queries of the request.",
+                    QUERY_BUCKETS,
+                ),
+            }
+
+    def observe(self, route, method, metrics, total):
+        labels = (("route", route), ("method", method))
+        with self._lock:
+            self.histograms["total"].observe(labels, total)
+            self.histograms["db"].observe(labels, metrics.db_time)
+            self.histograms["serializer"].observe(labels, metrics.serializer_time)
+            self.histograms["queries"].observe(labels, metrics.db_queries)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for histogram in self.histograms.values():
+                lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """
+    Records the database queries, database time, serializer time and total time of
+    every request, returns them in a Server-Timing header and aggregates them per route
+    in the registry (see the metrics view).
+
+    Enabled with the CHAT_METRICS_ENABLED setting, otherwise Django drops the
+    middleware from the chain when it starts.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.CHAT_METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+        connection_created.connect(add_query_recorder, dispatch_uid="chat_metrics")
+        for connection in connections.all(initialized_only=True):
+            add_query_recorder(connection=connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = request_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_metrics.reset(token)
+        return self.process_metrics(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = request_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_metrics.reset(token)
+        return self.process_metrics(request, response, metrics)
+
+    def process_metrics(self, request, response, metrics):
+        total = time.perf_counter() - metrics.started
+        match = request.resolver_match
+        # Routes keep the label set small, unlike paths with ids
+        route = match.route if match else "<unmatched>"
+        registry.observe(route, request.method, metrics, total)
+        response.headers["Server-Timing"] = metrics.server_timing(total)
+        return response
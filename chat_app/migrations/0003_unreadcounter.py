@@ -0,0 +1,82 @@
+# Generated by Django 5.1.6 on 2026-10-17 17:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def create_unread_counters(apps, schema_editor):
+    Thread = apps.get_model("chat_app", "Thread")
+    Message = apps.get_model("chat_app", "Message")
+    UnreadCounter = apps.get_model("chat_app", "UnreadCounter")
+
+    unread = (
+        Message.objects.filter(thread_id=OuterRef("thread_id"), is_read=False)
+        .exclude(sender_id=OuterRef("user_id"))
+        .order_by()
+        .values("thread_id")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    participants = Thread.participants.through.objects.annotate(
+        unread=Coalesce(Subquery(unread), 0)
+    ).values_list("thread_id", "user_id", "unread")
+
+    batch = []
+    for thread_id, user_id, count in participants.iterator(chunk_size=2000):
+        batch.append(UnreadCounter(thread_id=thread_id, user_id=user_id, count=count))
+        if len(batch) >= 2000:
+            UnreadCounter.objects.bulk_create(batch)
+            batch = []
+    UnreadCounter.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_app", "0002_message_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnreadCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "thread",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="unread_counters",
+                        to="chat_app.thread",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("thread", "user"), name="unique_unread_counter"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(create_unread_counters, migrations.RunPython.noop),
+    ]
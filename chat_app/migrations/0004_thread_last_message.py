@@ -0,0 +1,55 @@
+# Generated by Django 5.1.6 on 2026-10-17 17:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_last_message(apps, schema_editor):
+    Thread = apps.get_model("chat_app", "Thread")
+    Message = apps.get_model("chat_app", "Message")
+
+    latest_messages = Message.objects.filter(thread_id=OuterRef("pk")).order_by(
+        "-created", "-id"
+    )
+    Thread.objects.update(
+        last_message_id=Subquery(latest_messages.values("id")[:1]),
+        last_message_at=Coalesce(
+            Subquery(latest_messages.values("created")[:1]), F("created")
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_app", "0003_unreadcounter"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="thread",
+            options={"ordering": ["-last_message_at", "-id"]},
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="chat_app.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="last_message_at",
+            field=models.DateTimeField(
+                db_index=True, default=django.utils.timezone.now
+            ),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.1.6 on 2026-10-17 17:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def deduplicate_threads(apps, schema_editor):
+    """
+    Merge threads between the same two users into the oldest one and fill the
+    participant pair key of every thread with exactly two participants.
+    """
+    Thread = apps.get_model("chat_app", "Thread")
+    Message = apps.get_model("chat_app", "Message")
+    UnreadCounter = apps.get_model("chat_app", "UnreadCounter")
+
+    participants = {}
+    rows = (
+        Thread.participants.through.objects.order_by("thread_id", "user_id")
+        .values_list("thread_id", "user_id")
+        .iterator(chunk_size=2000)
+    )
+    for thread_id, user_id in rows:
+        participants.setdefault(thread_id, []).append(user_id)
+
+    keepers = {}
+    duplicates = {}
+    for thread_id in sorted(participants):
+        pair = tuple(participants[thread_id])
+        if len(pair) != 2:
+            continue
+        if pair in keepers:
+            duplicates[thread_id] = keepers[pair]
+        else:
+            keepers[pair] = thread_id
+
+    merged_into = set(duplicates.values())
+    for duplicate_id, keeper_id in duplicates.items():
+        Message.objects.filter(thread_id=duplicate_id).update(thread_id=keeper_id)
+    Thread.objects.filter(id__in=duplicates).delete()
+
+    # Unread counters and the last message of the threads that received messages
+    latest_messages = Message.objects.filter(thread_id=OuterRef("pk")).order_by(
+        "-created", "-id"
+    )
+    Thread.objects.filter(id__in=merged_into).update(
+        last_message_id=Subquery(latest_messages.values("id")[:1]),
+        last_message_at=Coalesce(
+            Subquery(latest_messages.values("created")[:1]), F("created")
+        ),
+    )
+    for counter in UnreadCounter.objects.filter(thread_id__in=merged_into):
+        counter.count = (
+            Message.objects.filter(thread_id=counter.thread_id, is_read=False)
+            .exclude(sender_id=counter.user_id)
+            .count()
+        )
+        counter.save(update_fields=["count"])
+
+    Thread.objects.bulk_update(
+        [
+            Thread(id=thread_id, participant_low_id=low_id, participant_high_id=high_id)
+            for (low_id, high_id), thread_id in keepers.items()
+        ],
+        ["participant_low", "participant_high"],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_app", "0004_thread_last_message"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="participant_high",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="participant_low",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(deduplicate_threads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-17 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Separate from 0005, PostgreSQL cannot alter a table with pending trigger
+    # events left by the data migration in the same transaction
+    dependencies = [
+        ("chat_app", "0005_thread_participant_pair"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="thread",
+            constraint=models.UniqueConstraint(
+                fields=("participant_low", "participant_high"),
+                name="unique_thread_participant_pair",
+            ),
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_to_slots(apps, schema_editor):
+    """
+    Copy the participants of the auto-created M2M table into ThreadParticipant,
+    the lower user id of a thread takes slot 0.
+    """
+    Thread = apps.get_model("chat_app", "Thread")
+    ThreadParticipant = apps.get_model("chat_app", "ThreadParticipant")
+
+    rows = (
+        Thread.participants.through.objects.order_by("thread_id", "user_id")
+        .values_list("thread_id", "user_id")
+        .iterator(chunk_size=2000)
+    )
+    batch = []
+    slots = {}
+    for thread_id, user_id in rows:
+        slot = slots.get(thread_id, 0)
+        if slot > 1:
+            # Left over by concurrent adds the old validator could not prevent
+            continue
+        slots[thread_id] = slot + 1
+        batch.append(ThreadParticipant(thread_id=thread_id, user_id=user_id, slot=slot))
+        if len(batch) >= 2000:
+            ThreadParticipant.objects.bulk_create(batch)
+            batch = []
+    ThreadParticipant.objects.bulk_create(batch)
+
+
+def copy_from_slots(apps, schema_editor):
+    Thread = apps.get_model("chat_app", "Thread")
+    ThreadParticipant = apps.get_model("chat_app", "ThreadParticipant")
+
+    rows = ThreadParticipant.objects.values_list("thread_id", "user_id").iterator(
+        chunk_size=2000
+    )
+    Thread.participants.through.objects.bulk_create(
+        (
+            Thread.participants.through(thread_id=thread_id, user_id=user_id)
+            for thread_id, user_id in rows
+        ),
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_app", "0006_thread_unique_participant_pair"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # Django cannot add a through model to an existing ManyToManyField, so the rows
+    # are copied into the new table and the field is replaced
+    operations = [
+        migrations.CreateModel(
+            name="ThreadParticipant",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "slot",
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, "First"), (1, "Second")]
+                    ),
+                ),
+                (
+                    "thread",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="chat_app.thread",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("thread", "user"), name="unique_thread_participant"
+                    ),
+                    models.UniqueConstraint(
+                        fields=("thread", "slot"),
+                        name="unique_thread_participant_slot",
+                    ),
+                    models.CheckConstraint(
+                        condition=models.Q(("slot__in", [0, 1])),
+                        name="thread_participant_slot_range",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(copy_to_slots, copy_from_slots),
+        migrations.RemoveField(
+            model_name="thread",
+            name="participants",
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="participants",
+            field=models.ManyToManyField(
+                through="chat_app.ThreadParticipant", to=settings.AUTH_USER_MODEL
+            ),
+        ),
+    ]
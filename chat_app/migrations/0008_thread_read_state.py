@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-17 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_app", "0007_threadparticipant"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="read_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="read_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
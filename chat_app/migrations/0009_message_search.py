@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-17 19:02
+
+from django.db import migrations
+
+from chat_app import search
+
+
+def install(apps, schema_editor):
+    search.install(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_app", "0008_thread_read_state"),
+    ]
+
+    # Full-text index of the message texts, see chat_app.search
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
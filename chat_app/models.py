@@ -1,26 +1,180 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
 from django.db.models.signals import m2m_changed
 from django.dispatch import receiver
+from django.utils import timezone
+
+
+class ThreadManager(models.Manager):
+    def get_or_create_for_pair(self, user, other_user):
+        """
+        Return the thread between two users and whether it was created.
+
+        The lookup goes by the unique participant pair key, so concurrent calls for
+        the same users end up with the same thread.
+        """
+        low_id, high_id = sorted([user.pk, other_user.pk])
+        with transaction.atomic():
+            thread, created = self.get_or_create(
+                participant_low_id=low_id, participant_high_id=high_id
+            )
+            if created:
+                # The pair key is already set, so the participant rows and their unread
+                # counters are inserted directly instead of through participants.add()
+                # and its m2m_changed receivers
+                user_ids = (low_id, high_id)
+                ThreadParticipant.objects.bulk_create(
+                    [
+                        ThreadParticipant(thread=thread, user_id=user_id, slot=slot)
+                        for slot, user_id in enumerate(user_ids)
+                    ]
+                )
+                UnreadCounter.objects.bulk_create(
+                    [
+                        UnreadCounter(thread=thread, user_id=user_id)
+                        for user_id in user_ids
+                    ]
+                )
+        return thread, created
+
+    def record_messages(self, thread_id, sender_id, last_message, count=1):
+        """
+        Count new messages of the sender as unread for the other participants and make
+        last_message the last message of the thread.
+        """
+        UnreadCounter.objects.filter(thread_id=thread_id).exclude(
+            user_id=sender_id
+        ).increment(count)
+        # The timestamp condition keeps a message committed late by a concurrent
+        # request from replacing a newer last message
+        self.filter(pk=thread_id, last_message_at__lte=last_message.created).update(
+            last_message=last_message,
+            last_message_at=last_message.created,
+            updated=last_message.created,
+        )
+
+    def record_read(self, thread_id):
+        # Called whenever messages of the thread are marked as read, the read state
+        # is one of the validators of the conditional GETs of the message views
+        return self.filter(pk=thread_id).update(
+            read_version=F("read_version") + 1, read_at=timezone.now()
+        )
 
 
 class Thread(models.Model):
-    participants = models.ManyToManyField(User)
+    participants = models.ManyToManyField(User, through="ThreadParticipant")
+    # Canonical key of the participant pair (the lower and the higher user id), kept
+    # in sync with "participants". The unique constraint makes the pair lookup a single
+    # index seek and prevents duplicate threads between the same users.
+    participant_low = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    participant_high = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # Denormalized latest activity, updated together with every new message, so the
+    # threads can be ordered by activity without aggregating over Message.
+    # A thread without messages is as active as its creation time.
+    last_message = models.ForeignKey(
+        "Message",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    last_message_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # Incremented, and read_at set, whenever messages of the thread are marked as read
+    read_version = models.PositiveIntegerField(default=0)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ThreadManager()
 
     class Meta:
-        ordering = ["-created"]
+        ordering = ["-last_message_at", "-id"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["participant_low", "participant_high"],
+                name="unique_thread_participant_pair",
+            ),
+        ]
+
+
+class ThreadParticipant(models.Model):
+    """
+    Participant of a thread.
+
+    A thread has two slots (0 and 1) and every participant takes one of them. The
+    unique constraints make the database reject a third participant, also for
+    concurrent requests, without counting the participants first. Rows are added
+    with get_or_create_for_pair(), or with participants.add(user,
+    through_defaults={"slot": ...}).
+    """
+
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    slot = models.PositiveSmallIntegerField(choices=[(0, "First"), (1, "Second")])
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["thread", "user"], name="unique_thread_participant"
+            ),
+            models.UniqueConstraint(
+                fields=["thread", "slot"], name="unique_thread_participant_slot"
+            ),
+            models.CheckConstraint(
+                condition=Q(slot__in=[0, 1]), name="thread_participant_slot_range"
+            ),
+        ]
+
 
+@receiver(m2m_changed, sender=ThreadParticipant)
+def sync_participant_pair(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # Changed from the user side, pk_set holds the thread ids
+        threads = Thread.objects.filter(pk__in=pk_set or ())
+    else:
+        threads = [instance]
+    for thread in threads:
+        user_ids = sorted(thread.participants.values_list("id", flat=True))
+        low_id, high_id = user_ids if len(user_ids) == 2 else (None, None)
+        if (thread.participant_low_id, thread.participant_high_id) != (low_id, high_id):
+            # "updated" changes the validators of the cached thread lists
+            Thread.objects.filter(pk=thread.pk).update(
+                participant_low_id=low_id,
+                participant_high_id=high_id,
+                updated=timezone.now(),
+            )
+            thread.participant_low_id, thread.participant_high_id = low_id, high_id
 
-# Need this signal to validate count of participants because clean() not works
-# Description: The clean() method is called before saving, and participants is a ManyToManyField.
-# But ManyToManyField is updated after the object is saved, so self.participants.count() inside clean() will always be 0.
-@receiver(m2m_changed, sender=Thread.participants.through)
-def validate_thread_participants(sender, instance, action, **kwargs):
-    if action == "post_add" and instance.participants.count() > 2:
-        raise ValidationError("A thread should have not more than 2 participants.")
+
+# Every participant gets an unread counter, so the counter row also tells that
+# a user is a participant of a thread
+@receiver(m2m_changed, sender=ThreadParticipant)
+def sync_unread_counters(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "post_add":
+        if reverse:
+            counters = [UnreadCounter(thread_id=pk, user=instance) for pk in pk_set]
+        else:
+            counters = [UnreadCounter(thread=instance, user_id=pk) for pk in pk_set]
+        UnreadCounter.objects.bulk_create(counters, ignore_conflicts=True)
+    elif action == "post_remove":
+        if reverse:
+            UnreadCounter.objects.filter(user=instance, thread_id__in=pk_set).delete()
+        else:
+            UnreadCounter.objects.filter(thread=instance, user_id__in=pk_set).delete()
+    elif action == "post_clear":
+        if reverse:
+            UnreadCounter.objects.filter(user=instance).delete()
+        else:
+            UnreadCounter.objects.filter(thread=instance).delete()
 
 
 class Message(models.Model):
@@ -31,15 +185,85 @@ class Message(models.Model):
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+    # Idempotency key chosen by the client, a retried message with the same key is not
+    # inserted again
+    client_id = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
         ordering = ["-created"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["thread", "sender", "client_id"],
+                condition=models.Q(client_id__isnull=False),
+                name="unique_message_client_id",
+            ),
+        ]
+        indexes = [
+            # Serves the message list of a thread (filter by thread, newest first)
+            # without a separate sort step. "id" is the tie-breaker for equal timestamps.
+            models.Index(
+                fields=["thread", "-created", "-id"], name="message_thread_created_idx"
+            ),
+            # Partial index that only holds unread messages, so unread counters
+            # stay cheap no matter how long the thread history is.
+            models.Index(
+                fields=["thread", "sender"],
+                condition=models.Q(is_read=False),
+                name="message_unread_idx",
+            ),
+        ]
 
     def clean(self):
-        if self.sender not in self.thread.participants.all():
+        # A single EXISTS on the participants table instead of loading the thread
+        # and all of its participants
+        if not ThreadParticipant.objects.filter(
+            thread_id=self.thread_id, user_id=self.sender_id
+        ).exists():
             raise ValidationError("Sender must be a participant of the thread.")
         super().clean()
 
-    def save(self, *args, **kwargs):
-        self.clean()
-        super().save(*args, **kwargs)
+    def save(self, *args, check_participant=True, **kwargs):
+        # Sender and thread of a message never change, so the participant check is only
+        # needed for new messages. Callers that have already checked it in the same
+        # request (see ThreadMessageSerializer) pass check_participant=False.
+        adding = self._state.adding
+        if adding and check_participant:
+            self.clean()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Thread.objects.record_messages(self.thread_id, self.sender_id, self)
+
+
+class UnreadCounterQuerySet(models.QuerySet):
+    def increment(self, by=1):
+        return self.update(count=F("count") + by)
+
+    def decrement(self, by=1):
+        # Never go below zero, even if a counter has drifted before a repair
+        return self.update(count=Greatest(F("count") - by, 0))
+
+
+class UnreadCounter(models.Model):
+    """
+    Number of unread messages of a thread for one participant.
+
+    Kept in sync on message creation and when messages are marked as read, so reading
+    the unread count is a single lookup instead of a COUNT over the thread messages.
+    Run "python manage.py repair_unread_counters" to recompute drifted counters.
+    """
+
+    thread = models.ForeignKey(
+        Thread, on_delete=models.CASCADE, related_name="unread_counters"
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = UnreadCounterQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["thread", "user"], name="unique_unread_counter"
+            ),
+        ]
@@ -0,0 +1,127 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over a (timestamp, id) pair, newest items first.
+
+    Unlike LimitOffsetPagination a page costs the same no matter how deep the client
+    scrolls, and new rows inserted at the top do not shift the following pages.
+    `next` points at older items (`?before=<cursor>`), `previous` at newer items
+    (`?after=<cursor>`), so infinite-scroll clients can also poll `previous` for
+    items that arrived after the first page was loaded.
+    """
+
+    # Field pair the pages are keyed on, the second field breaks ties of the first one
+    ordering = ("created", "id")
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    page_size_query_param = "limit"
+    before_query_param = "before"
+    after_query_param = "after"
+    invalid_cursor_message = "Invalid cursor."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        field, tiebreaker = self.ordering
+
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+        self.cursor = after or before
+
+        if after:
+            value, pk = self.decode_cursor(after, queryset.model)
+            queryset = queryset.filter(
+                Q(**{f"{field}__gt": value})
+                | Q(**{field: value, f"{tiebreaker}__gt": pk})
+            ).order_by(field, tiebreaker)
+        else:
+            if before:
+                value, pk = self.decode_cursor(before, queryset.model)
+                queryset = queryset.filter(
+                    Q(**{f"{field}__lt": value})
+                    | Q(**{field: value, f"{tiebreaker}__lt": pk})
+                )
+            queryset = queryset.order_by(f"-{field}", f"-{tiebreaker}")
+
+        # Fetch one extra row to know whether there is one more page in this direction
+        page = list(queryset[: page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+
+        if after:
+            # Newer items were fetched in ascending order, return them newest first
+            page.reverse()
+            self.has_next = True
+        else:
+            self.has_next = has_more
+
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        cursor = self.encode_cursor(self.page[-1]) if self.page else self.cursor
+        url = remove_query_param(self.base_url, self.after_query_param)
+        return replace_query_param(url, self.before_query_param, cursor)
+
+    def get_previous_link(self):
+        cursor = self.encode_cursor(self.page[0]) if self.page else self.cursor
+        if cursor is None:
+            return None
+        url = remove_query_param(self.base_url, self.before_query_param)
+        return replace_query_param(url, self.after_query_param, cursor)
+
+    def encode_cursor(self, item):
+        values = [
+            item[name] if isinstance(item, dict) else getattr(item, name)
+            for name in self.ordering
+        ]
+        payload = json.dumps([str(value) for value in values])
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor, model):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return tuple(
+                model._meta.get_field(name).to_python(value)
+                for name, value in zip(self.ordering, values, strict=True)
+            )
+        except (TypeError, ValueError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class ThreadKeysetPagination(KeysetPagination):
+    # Threads are listed by their latest activity, see Thread.last_message_at
+    ordering = ("last_message_at", "id")
@@ -0,0 +1,143 @@
+"""
+Full-text search over the message texts.
+
+SQLite: an FTS5 table with the message texts (external content, so the texts are not
+stored twice), kept in sync by triggers. PostgreSQL: a GIN index over the tsvector of
+the texts. Both use "simple" tokenization, whole words without stemming, case and
+accent insensitive on SQLite. Other backends fall back to a LIKE scan.
+"""
+
+from django.db.models import BooleanField, FloatField, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = "chat_app_message_fts"
+
+SQLITE_INSTALL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        text, content='chat_app_message', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON chat_app_message
+    BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON chat_app_message
+    BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END
+    """,
+    # Only text changes touch the index, not the read state
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF text ON chat_app_message
+    BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+]
+
+SQLITE_UNINSTALL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# Same expression in the index and in the queries, or PostgreSQL cannot use the index
+POSTGRESQL_VECTOR = "to_tsvector('simple'::regconfig, {column})"
+
+POSTGRESQL_INSTALL = [
+    "CREATE INDEX IF NOT EXISTS message_text_search_idx ON chat_app_message "
+    f"USING GIN ({POSTGRESQL_VECTOR.format(column='text')})",
+]
+
+POSTGRESQL_UNINSTALL = ["DROP INDEX IF EXISTS message_text_search_idx"]
+
+
+def install(connection):
+    """
+    Create the search index of the connection's database and fill it.
+
+    Also run after every migrate (see ChatConfig.ready()): SQLite drops the triggers
+    when a migration rebuilds the message table, the index is rebuilt then.
+    """
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+                "AND tbl_name = 'chat_app_message' AND name LIKE %s",
+                [f"{FTS_TABLE}_%"],
+            )
+            if cursor.fetchone()[0] == 3:
+                return
+            for sql in SQLITE_INSTALL:
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for sql in POSTGRESQL_INSTALL:
+                cursor.execute(sql)
+
+
+def uninstall(connection):
+    statements = {"sqlite": SQLITE_UNINSTALL, "postgresql": POSTGRESQL_UNINSTALL}
+    with connection.cursor() as cursor:
+        for sql in statements.get(connection.vendor, []):
+            cursor.execute(sql)
+
+
+def fts5_query(text):
+    # Every word as a quoted string, so the input never fails as FTS5 query syntax.
+    # The words are ANDed.
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+def search_messages(queryset, text, vendor):
+    """
+    Filter a Message queryset by the words of text and annotate it with "rank", higher
+    is a better match.
+    """
+    if vendor == "sqlite":
+        # The matches are read from the index once: MATERIALIZED keeps SQLite from
+        # turning the rank subquery into a MATCH per message, and the result of the
+        # uncorrelated CTE is reused (and indexed) for every row. bm25() is the "rank"
+        # column, lower is better.
+        matches = f"SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        query = fts5_query(text)
+        return queryset.filter(
+            RawSQL(
+                f'"chat_app_message"."id" IN (SELECT rowid FROM {FTS_TABLE} '
+                f"WHERE {FTS_TABLE} MATCH %s)",
+                [query],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            rank=RawSQL(
+                f"(WITH matches AS MATERIALIZED ({matches}) SELECT -rank FROM matches "
+                'WHERE rowid = "chat_app_message"."id")',
+                [query],
+                output_field=FloatField(),
+            )
+        )
+    if vendor == "postgresql":
+        vector = POSTGRESQL_VECTOR.format(column='"chat_app_message"."text"')
+        query = "websearch_to_tsquery('simple'::regconfig, %s)"
+        return queryset.filter(
+            RawSQL(f"{vector} @@ {query}", [text], output_field=BooleanField())
+        ).annotate(
+            rank=RawSQL(
+                f"ts_rank({vector}, {query})", [text], output_field=FloatField()
+            )
+        )
+    words = text.split()
+    for word in words:
+        queryset = queryset.filter(text__icontains=word)
+    return queryset.annotate(rank=Value(0.0))
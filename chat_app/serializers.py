@@ -1,8 +1,23 @@
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
 from rest_framework import serializers
+from rest_framework_simplejwt import serializers as jwt_serializers
 
-from chat_app.models import Thread, Message
+from chat_app import events
+from chat_app.authentication import USERNAME_CLAIM
+from chat_app.metrics import TimedSerializerMixin, serializer_timer
+from chat_app.models import Thread, ThreadParticipant, Message, UnreadCounter
+
+
+class TokenObtainSlidingSerializer(jwt_serializers.TokenObtainSlidingSerializer):
+    @classmethod
+    def get_token(cls, user):
+        # StatelessJWTAuthentication can build request.user from the token claims
+        token = super().get_token(user)
+        token[USERNAME_CLAIM] = user.get_username()
+        return token
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -11,7 +26,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ["id", "username"]
 
 
-class ThreadSerializer(serializers.ModelSerializer):
+class ThreadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     username = serializers.CharField(write_only=True)
     participants = UserSerializer(many=True, read_only=True)
 
@@ -39,31 +54,74 @@ class ThreadSerializer(serializers.ModelSerializer):
         my_user = self.context["request"].user
         invited_user = validated_data["username"]
 
-        # Searching for an existing thread
-        thread = (
-            Thread.objects.filter(participants=my_user)
-            .filter(participants=invited_user)
-            .first()
-        )
-        if thread:
+        # Existing thread is found by the unique participant pair key, a new one is
+        # created only if there is none (also for concurrent requests)
+        thread, created = Thread.objects.get_or_create_for_pair(my_user, invited_user)
+        if created:
+            events.notify_thread_created(thread, [my_user.id, invited_user.id])
+        else:
             # Flag to show that we need return 200 status code in ViewSet
             self._existing_thread = True
-            return thread
-
-        thread = Thread.objects.create()
-        thread.participants.set([my_user, invited_user])
 
         return thread
 
 
-class ThreadMessageSerializer(serializers.ModelSerializer):
+class ThreadParticipantMixin:
+    # Validates that the request user is a participant of the thread of the view,
+    # context["thread_id"]
+    def get_sender_is_participant(self):
+        """
+        Return whether the request user is a participant of the thread, or None if the
+        thread does not exist.
+
+        One query for both checks, cached for the lifetime of the serializer, so
+        validate() and create() of a request do not look the thread up again.
+        """
+        if "sender_is_participant" not in self.context:
+            thread_id = self.context.get("thread_id")
+            self.context["sender_is_participant"] = (
+                Thread.objects.filter(id=thread_id)
+                .annotate(
+                    is_participant=Exists(
+                        ThreadParticipant.objects.filter(
+                            thread_id=OuterRef("pk"),
+                            user_id=self.context["request"].user.id,
+                        )
+                    )
+                )
+                .values_list("is_participant", flat=True)
+                .first()
+            )
+        return self.context["sender_is_participant"]
+
+    def validate(self, data):
+        is_participant = self.get_sender_is_participant()
+        if is_participant is None:
+            thread_id = self.context.get("thread_id")
+            raise serializers.ValidationError(
+                {"detail": f"Thread with id {thread_id} does not exist."}
+            )
+
+        if not is_participant:
+            raise serializers.ValidationError(
+                {"detail": "Sender must be a participant of the thread."}
+            )
+
+        return data
+
+
+class ThreadMessageSerializer(
+    ThreadParticipantMixin, TimedSerializerMixin, serializers.ModelSerializer
+):
     sender = UserSerializer(read_only=True)
     text = serializers.CharField()
     created = serializers.DateTimeField(read_only=True)
+    # Idempotency key of a new message, a retry with the same key returns the message
+    client_id = serializers.CharField(max_length=64, required=False, write_only=True)
 
     class Meta:
         model = Message
-        fields = ["id", "sender", "text", "is_read", "created"]
+        fields = ["id", "sender", "text", "is_read", "created", "client_id"]
 
     def validate_is_read(self, value):
         sender = self.context["request"].user
@@ -77,27 +135,218 @@ class ThreadMessageSerializer(serializers.ModelSerializer):
             )
         return value
 
-    def validate(self, data):
-        thread_id = self.context.get("thread_id")
-        thread = Thread.objects.filter(id=thread_id).first()
-        if not thread:
-            raise serializers.ValidationError(
-                {"detail": f"Thread with id {thread_id} does not exist."}
+    def create(self, validated_data):
+        # Always set is_read=False on creation to prevent set up is_read=False on message creation
+        # and allow to set is_read=True with PATCH request
+        validated_data["is_read"] = False
+        message = Message(
+            thread_id=self.context.get("thread_id"),
+            sender=self.context["request"].user,
+            **validated_data,
+        )
+        try:
+            # Participation has been checked by validate() already. save() is atomic,
+            # a failed INSERT leaves no side effects.
+            message.save(check_participant=not self.get_sender_is_participant())
+        except IntegrityError:
+            # Inserting first keeps new messages at one query, only a retry pays for
+            # the lookup of the message it has already posted
+            existing = self.get_existing_message(message)
+            if existing is None:
+                raise
+            # Flag to show that we need return 200 status code in ViewSet
+            self._existing_message = True
+            return existing
+        events.notify_message_created(message, self.to_representation(message))
+        return message
+
+    def get_existing_message(self, message):
+        if message.client_id is None:
+            return None
+        return (
+            Message.objects.select_related("sender")
+            .filter(
+                thread_id=message.thread_id,
+                sender_id=message.sender_id,
+                client_id=message.client_id,
             )
+            .first()
+        )
+
+    def update(self, instance, validated_data):
+        if validated_data.pop("is_read", False) and not instance.is_read:
+            with transaction.atomic():
+                # Conditional UPDATE, so two concurrent requests for the same message
+                # decrement the unread counter only once
+                marked = Message.objects.filter(pk=instance.pk, is_read=False).update(
+                    is_read=True
+                )
+                if marked:
+                    UnreadCounter.objects.filter(thread_id=instance.thread_id).exclude(
+                        user_id=instance.sender_id
+                    ).decrement()
+                    Thread.objects.record_read(instance.thread_id)
+                    events.notify_messages_read(
+                        instance.thread_id,
+                        self.context["request"].user.id,
+                        message_id=instance.id,
+                    )
+            instance.is_read = True
+
+        if not validated_data:
+            return instance
+        return super().update(instance, validated_data)
+
+
+class MessageBatchItemSerializer(serializers.Serializer):
+    text = serializers.CharField()
+    client_id = serializers.CharField(max_length=64, required=False)
 
-        if self.context["request"].user not in thread.participants.all():
+
+class MessageBatchSerializer(
+    ThreadParticipantMixin, TimedSerializerMixin, serializers.Serializer
+):
+    """
+    Several messages of the request user posted to a thread at once.
+
+    Participation is checked once and the messages are inserted with one bulk INSERT.
+    Messages with a client_id that the user has already posted to the thread are not
+    inserted again, so a retried batch returns the same messages. save() returns the
+    messages in the order of the request.
+    """
+
+    max_messages = 500
+
+    messages = MessageBatchItemSerializer(
+        many=True, allow_empty=False, max_length=max_messages
+    )
+
+    def validate_messages(self, value):
+        client_ids = [item["client_id"] for item in value if "client_id" in item]
+        if len(set(client_ids)) != len(client_ids):
             raise serializers.ValidationError(
-                {"detail": "Sender must be a participant of the thread."}
+                "The 'client_id' of every message must be unique."
             )
-
-        return data
+        return value
 
     def create(self, validated_data):
-        # Always set is_read=False on creation to prevent set up is_read=False on message creation
-        # and allow to set is_read=True with PATCH request
-        validated_data["is_read"] = False
+        try:
+            with transaction.atomic():
+                return self.insert(validated_data["messages"])
+        except IntegrityError:
+            # A concurrent retry of the same batch has inserted some of the messages
+            # first, they are found now
+            with transaction.atomic():
+                return self.insert(validated_data["messages"])
+
+    def insert(self, items):
         thread_id = self.context.get("thread_id")
-        thread = Thread.objects.filter(id=thread_id).first()
         sender = self.context["request"].user
-        message = Message.objects.create(thread=thread, sender=sender, **validated_data)
-        return message
+        client_ids = [item["client_id"] for item in items if "client_id" in item]
+        existing = {}
+        if client_ids:
+            existing = {
+                message.client_id: message
+                for message in Message.objects.select_related("sender").filter(
+                    thread_id=thread_id, sender=sender, client_id__in=client_ids
+                )
+            }
+
+        messages = []
+        new_messages = []
+        for item in items:
+            message = existing.get(item.get("client_id"))
+            if message is None:
+                message = Message(thread_id=thread_id, sender=sender, **item)
+                new_messages.append(message)
+            messages.append(message)
+
+        # bulk_create() skips Message.save(), its side effects are applied once for
+        # all the new messages
+        Message.objects.bulk_create(new_messages)
+        if new_messages:
+            Thread.objects.record_messages(
+                thread_id, sender.id, new_messages[-1], count=len(new_messages)
+            )
+            events.notify_messages_created(
+                thread_id,
+                sender.id,
+                ThreadMessageSerializer(new_messages, many=True).data,
+            )
+        # Flag to show that we need return 201 status code in ViewSet
+        self._created_count = len(new_messages)
+        return messages
+
+
+class MessageRowSerializer(TimedSerializerMixin, serializers.BaseSerializer):
+    """
+    Read-only ThreadMessageSerializer for rows fetched with values(*values_fields).
+
+    Builds the same data (and so the same JSON) as ThreadMessageSerializer without
+    going through the fields of both serializers for every row, which dominates the
+    time of large message pages.
+    """
+
+    values_fields = (
+        "id",
+        "sender_id",
+        "sender__username",
+        "text",
+        "is_read",
+        "created",
+    )
+    # Formats the time like ThreadMessageSerializer, with DATETIME_FORMAT in the
+    # current time zone
+    created_field = serializers.DateTimeField()
+
+    def to_representation(self, row):
+        # Timed here, TimedSerializerMixin wraps the super() call this method replaces
+        with serializer_timer():
+            return {
+                "id": row["id"],
+                "sender": {
+                    "id": row["sender_id"],
+                    "username": row["sender__username"],
+                },
+                "text": row["text"],
+                "is_read": row["is_read"],
+                "created": self.created_field.to_representation(row["created"]),
+            }
+
+
+class MessageSearchResultSerializer(MessageRowSerializer):
+    # Results come from all threads of the user
+    values_fields = MessageRowSerializer.values_fields + ("thread_id",)
+
+    def to_representation(self, row):
+        return {"thread": row["thread_id"], **super().to_representation(row)}
+
+
+class InboxThreadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    participants = UserSerializer(many=True, read_only=True)
+    last_message = ThreadMessageSerializer(read_only=True, allow_null=True)
+    # Annotated by ThreadViewSet.inbox()
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Thread
+        fields = [
+            "id",
+            "participants",
+            "created",
+            "updated",
+            "last_message",
+            "unread_count",
+        ]
+
+
+class MarkThreadReadSerializer(TimedSerializerMixin, serializers.Serializer):
+    up_to_id = serializers.IntegerField(required=False, min_value=1)
+    up_to = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if "up_to_id" not in data and "up_to" not in data:
+            raise serializers.ValidationError(
+                {"detail": "Either 'up_to_id' or 'up_to' is required."}
+            )
+        return data
@@ -0,0 +1,132 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import SlidingToken
+
+from chat_app.models import Thread
+from chat_app.serializers import TokenObtainSlidingSerializer
+
+
+class StatelessJWTAuthenticationTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+        self.thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        self.unread_count_url = reverse("unread_count", args=[self.thread.id])
+
+    def authenticate(self, user):
+        token = TokenObtainSlidingSerializer.get_token(user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_obtained_token_has_username_claim(self):
+        response = self.client.post(
+            reverse("token_obtain"),
+            {"username": "user1", "password": "testpass123"},
+            format="json",
+        )
+
+        token = SlidingToken(response.data["token"])
+        self.assertEqual(token["username"], "user1")
+
+    @override_settings(CHAT_AUTH_STATELESS=True)
+    def test_stateless_user_is_not_loaded(self):
+        # The thread state query only
+        self.authenticate(self.user1)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.unread_count_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Tokens issued before the username claim still load the user
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {SlidingToken.for_user(self.user1)}"
+        )
+        with self.assertNumQueries(2):
+            response = self.client.get(self.unread_count_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_views_work_with_token_user(self):
+        self.authenticate(self.user1)
+
+        response = self.client.post(
+            reverse("threads"), {"username": "user1"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            reverse("threads"), {"username": "user2"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["id"], self.thread.id)
+
+        response = self.client.post(
+            reverse("messages", args=[self.thread.id]), {"text": "Hello"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            response.data["sender"], {"id": self.user1.id, "username": "user1"}
+        )
+
+        response = self.client.get(reverse("messages", args=[self.thread.id]))
+        self.assertEqual(response.data["count"], 1)
+
+    @override_settings(CHAT_AUTH_STATELESS=True)
+    def test_deferred_fields_are_loaded_on_access(self):
+        admin = User.objects.create_superuser(username="admin", password="admin")
+        self.authenticate(admin)
+
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cached_user(self):
+        self.authenticate(self.user1)
+        # User and thread state, then the thread state only
+        with self.assertNumQueries(2):
+            self.client.get(self.unread_count_url)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.unread_count_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(CHAT_AUTH_USER_CACHE_TIMEOUT=0)
+    def test_user_is_loaded_without_cache(self):
+        self.authenticate(self.user1)
+        for _ in range(2):
+            with self.assertNumQueries(2):
+                response = self.client.get(self.unread_count_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_inactive_user_is_rejected(self):
+        self.user1.is_active = False
+        self.user1.save()
+        self.authenticate(self.user1)
+
+        response = self.client.get(self.unread_count_url)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_changed_user_is_not_served_from_cache(self):
+        self.authenticate(self.user1)
+        self.client.get(self.unread_count_url)
+
+        self.user1.is_active = False
+        self.user1.save()
+
+        response = self.client.get(self.unread_count_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user_is_rejected(self):
+        self.authenticate(self.user1)
+        self.client.get(self.unread_count_url)
+
+        self.user1.delete()
+
+        response = self.client.post(
+            reverse("threads"), {"username": "user2"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,140 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from chat_app.models import Thread, Message
+
+
+class CachedListTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+        self.user3 = User.objects.create_user(username="user3", password="testpass123")
+        self.thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        self.message = Message.objects.create(
+            text="Hello", sender=self.user2, thread=self.thread
+        )
+        self.client.force_authenticate(user=self.user1)
+        self.threads_url = reverse("threads")
+        self.messages_url = reverse("messages", args=[self.thread.id])
+
+    def test_second_request_is_served_from_cache(self):
+        # The versions only, read from the database
+        for url in (self.threads_url, self.messages_url):
+            first = self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                second = self.client.get(url)
+
+            self.assertEqual(len(queries), 1)
+            self.assertEqual(second.status_code, status.HTTP_200_OK)
+            self.assertEqual(second.json(), first.json())
+            self.assertEqual(second["ETag"], first["ETag"])
+            self.assertIn("private", second["Cache-Control"])
+            self.assertIn("Authorization", second["Vary"])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.threads_url)["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                self.threads_url, headers={"If-None-Match": etag}
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(len(queries), 1)
+
+    def test_query_string_and_user_have_own_pages(self):
+        etag = self.client.get(self.messages_url)["ETag"]
+        self.assertNotEqual(
+            self.client.get(self.messages_url, {"limit": 1})["ETag"], etag
+        )
+
+        self.client.force_authenticate(user=self.user2)
+        response = self.client.get(self.messages_url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_message_post_invalidates_both_participants(self):
+        etags = {}
+        for user in (self.user1, self.user2):
+            self.client.force_authenticate(user=user)
+            etags[user] = (
+                self.client.get(self.threads_url)["ETag"],
+                self.client.get(self.messages_url)["ETag"],
+            )
+
+        self.client.force_authenticate(user=self.user1)
+        self.client.post(self.messages_url, {"text": "New"}, format="json")
+
+        for user in (self.user1, self.user2):
+            self.client.force_authenticate(user=user)
+            threads_response = self.client.get(
+                self.threads_url, headers={"If-None-Match": etags[user][0]}
+            )
+            messages_response = self.client.get(
+                self.messages_url, headers={"If-None-Match": etags[user][1]}
+            )
+            self.assertEqual(threads_response.status_code, status.HTTP_200_OK)
+            self.assertEqual(messages_response.status_code, status.HTTP_200_OK)
+            self.assertEqual(messages_response.json()["count"], 2)
+
+    def test_read_invalidates_message_pages(self):
+        self.client.get(self.messages_url)
+
+        self.client.patch(
+            reverse("messages", args=[self.thread.id, self.message.id]),
+            {"is_read": True},
+            format="json",
+        )
+
+        response = self.client.get(self.messages_url)
+        self.assertTrue(response.json()["results"][0]["is_read"])
+
+    def test_thread_create_and_delete_invalidate_thread_lists(self):
+        self.assertEqual(self.client.get(self.threads_url).json()["count"], 1)
+
+        response = self.client.post(
+            self.threads_url, {"username": "user3"}, format="json"
+        )
+        self.assertEqual(self.client.get(self.threads_url).json()["count"], 2)
+
+        self.client.delete(reverse("delete_thread", args=[response.json()["id"]]))
+        self.assertEqual(self.client.get(self.threads_url).json()["count"], 1)
+
+    def test_participant_change_invalidates_thread_lists(self):
+        etag = self.client.get(self.threads_url)["ETag"]
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.client.get(self.threads_url).json()["count"], 1)
+
+        self.thread.participants.remove(self.user2)
+
+        self.assertEqual(self.client.get(self.threads_url).json()["count"], 0)
+        # The remaining participant sees the thread without user2
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(self.threads_url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()["results"][0]["participants"]), 1)
+
+    def test_changes_outside_the_process_invalidate_thread_lists(self):
+        # Versions are read from the database, so a change made by another worker or a
+        # command is seen without any cache invalidation
+        etag = self.client.get(self.threads_url)["ETag"]
+
+        Message.objects.bulk_create(
+            [Message(text="Imported", sender=self.user2, thread=self.thread)]
+        )
+        call_command("backfill_thread_activity", stdout=StringIO())
+
+        response = self.client.get(self.threads_url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
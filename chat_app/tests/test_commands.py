@@ -0,0 +1,327 @@
+import json
+import re
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import LiveServerTestCase, TransactionTestCase
+
+from chat_app.archive import FIELDS, dump_row, open_archive
+from chat_app.models import Thread, ThreadParticipant, Message, UnreadCounter
+
+THREAD_FIELDS = [name for name in FIELDS["thread"] if "participant" not in name]
+
+
+class BenchmarkQueriesCommandTest(TransactionTestCase):
+    def test_benchmark_seeds_data_and_restores_indexes(self):
+        out = StringIO()
+        call_command(
+            "benchmark_queries",
+            users=5,
+            threads=3,
+            messages=50,
+            repeat=1,
+            stdout=out,
+        )
+
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Thread.objects.count(), 3)
+        self.assertEqual(Message.objects.count(), 50)
+
+        output = out.getvalue()
+        self.assertIn("=== without indexes ===", output)
+        self.assertIn("=== with indexes ===", output)
+
+        # Indexes dropped for the baseline run have to be created again
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Message._meta.db_table
+            )
+        self.assertIn("message_thread_created_idx", constraints)
+        self.assertIn("message_unread_idx", constraints)
+
+
+class BenchmarkSerializersCommandTest(TransactionTestCase):
+    def test_benchmark_compares_paths_and_rolls_back(self):
+        out = StringIO()
+        call_command("benchmark_serializers", messages=30, repeat=1, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn("Both paths render identical JSON", output)
+        self.assertEqual(output.count("fetch, serialize and render"), 2)
+        self.assertFalse(Message.objects.exists())
+
+
+class BenchmarkSearchCommandTest(TransactionTestCase):
+    def test_benchmark_compares_paths_and_rolls_back(self):
+        out = StringIO()
+        call_command("benchmark_search", messages=200, repeat=1, stdout=out)
+
+        output = out.getvalue()
+        # Same matches with LIKE and with the index
+        matches = re.findall(r"^(.+): [\d.]+ ms \(([\d,]+)\)$", output, re.MULTILINE)
+        self.assertEqual(len(matches), 6)
+        self.assertEqual(matches[:3], matches[3:])
+        self.assertEqual(output.count("the index is"), 3)
+        self.assertFalse(Message.objects.exists())
+
+
+class RepairUnreadCountersCommandTest(TransactionTestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+
+        self.thread_between_1_and_2, _ = Thread.objects.get_or_create_for_pair(
+            self.user1, self.user2
+        )
+
+        for i in range(3):
+            Message.objects.create(
+                sender=self.user1, thread=self.thread_between_1_and_2, text=f"{i}"
+            )
+
+    def test_repair_drifted_and_missing_counters(self):
+        UnreadCounter.objects.filter(user=self.user2).update(count=10)
+        UnreadCounter.objects.filter(user=self.user1).delete()
+
+        out = StringIO()
+        call_command("repair_unread_counters", stdout=out)
+
+        self.assertEqual(
+            set(
+                UnreadCounter.objects.filter(
+                    thread=self.thread_between_1_and_2
+                ).values_list("user_id", "count")
+            ),
+            {(self.user1.id, 0), (self.user2.id, 3)},
+        )
+        self.assertIn("Repaired 2 unread counters", out.getvalue())
+
+    def test_repair_removes_counters_of_non_participants(self):
+        user3 = User.objects.create_user(username="user3", password="testpass123")
+        UnreadCounter.objects.create(thread=self.thread_between_1_and_2, user=user3)
+
+        out = StringIO()
+        call_command("repair_unread_counters", stdout=out)
+
+        self.assertFalse(UnreadCounter.objects.filter(user=user3).exists())
+        self.assertIn("Repaired 0 unread counters, removed 1", out.getvalue())
+
+
+class BackfillThreadActivityCommandTest(TransactionTestCase):
+    def test_backfill_last_message(self):
+        user1 = User.objects.create_user(username="user1", password="testpass123")
+        user2 = User.objects.create_user(username="user2", password="testpass123")
+        thread, _ = Thread.objects.get_or_create_for_pair(user1, user2)
+        empty_thread = Thread.objects.create()
+        Message.objects.create(sender=user1, thread=thread, text="First")
+        last_message = Message.objects.create(sender=user2, thread=thread, text="Last")
+        Thread.objects.update(last_message=None)
+
+        out = StringIO()
+        call_command("backfill_thread_activity", batch_size=1, stdout=out)
+
+        thread.refresh_from_db()
+        self.assertEqual(thread.last_message, last_message)
+        self.assertEqual(thread.last_message_at, last_message.created)
+        empty_thread.refresh_from_db()
+        self.assertIsNone(empty_thread.last_message)
+        self.assertEqual(empty_thread.last_message_at, empty_thread.created)
+        self.assertIn("Backfilled 2 threads.", out.getvalue())
+
+
+class ExportImportChatCommandTest(TransactionTestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+        self.thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        for i in range(5):
+            Message.objects.create(
+                sender=(self.user1, self.user2)[i % 2],
+                thread=self.thread,
+                text=f"Message {i}",
+                client_id=f"c{i}",
+            )
+        marked = Message.objects.filter(sender=self.user2).update(is_read=True)
+        UnreadCounter.objects.filter(user=self.user1).decrement(marked)
+        Thread.objects.record_read(self.thread.id)
+        self.path = Path(tempfile.mkdtemp()) / "chat.ndjson.gz"
+
+    def snapshot(self):
+        return (
+            list(Thread.objects.values(*THREAD_FIELDS)),
+            list(
+                Message.objects.order_by("id").values(
+                    "id",
+                    "thread",
+                    "sender__username",
+                    "text",
+                    "created",
+                    "is_read",
+                    "client_id",
+                )
+            ),
+            list(
+                UnreadCounter.objects.order_by("user__username").values_list(
+                    "user__username", "count"
+                )
+            ),
+        )
+
+    def test_export_and_import(self):
+        before = self.snapshot()
+        out = StringIO()
+        call_command("export_chat", self.path, chunk_size=2, stdout=out)
+        self.assertIn(
+            "Exported 2 users, 1 threads, 2 participants, 5 messages", out.getvalue()
+        )
+
+        # Users are matched by username, deleted ones are created again
+        User.objects.filter(username="user2").delete()
+        Thread.objects.all().delete()
+        out = StringIO()
+        call_command("import_chat", self.path, batch_size=2, stdout=out)
+
+        self.assertIn(
+            "Imported 2 users, 1 threads, 2 participants, 5 messages", out.getvalue()
+        )
+        self.assertEqual(self.snapshot(), before)
+        user2 = User.objects.get(username="user2")
+        self.assertFalse(user2.has_usable_password())
+        # Ids continue after the imported ones
+        message = Message.objects.create(sender=user2, thread=self.thread, text="New")
+        self.assertGreater(message.id, before[1][-1]["id"])
+
+    def test_import_with_users_numbered_differently(self):
+        call_command("export_chat", self.path, stdout=StringIO())
+        # user1 is created again after user2, so it gets the higher id
+        Thread.objects.all().delete()
+        User.objects.filter(username="user1").delete()
+        call_command("import_chat", self.path, stdout=StringIO())
+
+        user1 = User.objects.get(username="user1")
+        self.assertGreater(user1.id, self.user2.id)
+        thread = Thread.objects.get()
+        self.assertEqual(
+            (thread.participant_low_id, thread.participant_high_id),
+            (self.user2.id, user1.id),
+        )
+        self.assertEqual(
+            list(
+                ThreadParticipant.objects.order_by("slot").values_list(
+                    "user_id", flat=True
+                )
+            ),
+            [self.user2.id, user1.id],
+        )
+        self.assertEqual(
+            Thread.objects.get_or_create_for_pair(user1, self.user2), (thread, False)
+        )
+
+    def test_export_includes_senders_who_left(self):
+        user3 = User.objects.create_user(username="user3", password="testpass123")
+        other_thread, _ = Thread.objects.get_or_create_for_pair(self.user1, user3)
+        Message.objects.create(sender=user3, thread=other_thread, text="Bye")
+        other_thread.participants.remove(user3)
+        out = StringIO()
+        call_command("export_chat", self.path, stdout=out)
+        self.assertIn("Exported 3 users", out.getvalue())
+
+        Thread.objects.all().delete()
+        user3.delete()
+        call_command("import_chat", self.path, stdout=StringIO())
+
+        message = Message.objects.get(text="Bye")
+        self.assertEqual(message.sender.username, "user3")
+
+    def test_import_with_unknown_user(self):
+        with open_archive(self.path, "w") as archive:
+            archive.write(dump_row("user", {"id": 1, "username": "user1"}))
+            archive.write(
+                dump_row("participant", {"thread_id": 1, "user_id": 2, "slot": 0})
+            )
+        Thread.objects.all().delete()
+
+        with self.assertRaisesMessage(CommandError, "Unknown user id 2"):
+            call_command("import_chat", self.path, stdout=StringIO())
+
+    def test_import_into_database_with_threads(self):
+        call_command("export_chat", self.path, stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command("import_chat", self.path, stdout=StringIO())
+
+
+class BenchmarkSqliteCommandTest(TransactionTestCase):
+    def test_benchmark_compares_default_and_tuned(self):
+        out = StringIO()
+        call_command(
+            "benchmark_sqlite",
+            seconds=0.2,
+            readers=1,
+            writers=1,
+            messages=100,
+            stdout=out,
+        )
+
+        output = out.getvalue()
+        self.assertIn("default", output)
+        self.assertIn("tuned", output)
+        self.assertEqual(output.count("writes"), 2)
+
+
+class BenchmarkApiCommandTest(LiveServerTestCase):
+    def test_benchmark_reports_all_scenarios(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = Path(directory.name) / "results.json"
+
+        out = StringIO()
+        call_command(
+            "benchmark_api",
+            url=self.live_server_url,
+            users=4,
+            threads=3,
+            messages=30,
+            requests=4,
+            concurrency=1,
+            query_samples=1,
+            output=str(output),
+            stdout=out,
+        )
+
+        results = json.loads(output.read_text())["scenarios"]
+        self.assertEqual(
+            set(results),
+            {
+                "token",
+                "thread_create",
+                "thread_list",
+                "message_post",
+                "message_list",
+                "message_read",
+                "unread_count",
+            },
+        )
+        for scenario, result in results.items():
+            self.assertEqual(result["requests"], 4, scenario)
+            self.assertEqual(result["errors"], 0, scenario)
+            self.assertGreater(result["queries_per_request"], 0, scenario)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"], scenario)
+
+        call_command(
+            "benchmark_api",
+            url=self.live_server_url,
+            users=4,
+            threads=3,
+            messages=30,
+            requests=2,
+            concurrency=1,
+            scenarios=["unread_count"],
+            baseline=str(output),
+            stdout=out,
+        )
+        self.assertIn("unread_count: requests_per_second", out.getvalue())
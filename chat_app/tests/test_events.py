@@ -0,0 +1,204 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import SlidingToken
+
+from chat_app.events import InMemoryBroker
+from chat_app.models import Thread, Message
+from my_django_chat_project.asgi import application
+
+
+class InMemoryBrokerTest(TransactionTestCase):
+    async def test_publish_to_subscribers_of_topic(self):
+        broker = InMemoryBroker()
+        subscription = broker.subscribe(["user.1"])
+        other_subscription = broker.subscribe(["user.2"])
+
+        broker.publish("user.1", {"type": "test"})
+
+        self.assertEqual(
+            await asyncio.wait_for(subscription.get(), 1), {"type": "test"}
+        )
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(other_subscription.get(), 0.05)
+
+    async def test_closed_subscription_receives_nothing(self):
+        broker = InMemoryBroker()
+        subscription = broker.subscribe(["user.1"])
+        subscription.close()
+
+        broker.publish("user.1", {"type": "test"})
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(subscription.get(), 0.05)
+
+    async def test_publish_from_another_thread(self):
+        broker = InMemoryBroker()
+        subscription = broker.subscribe(["user.1"])
+
+        await sync_to_async(broker.publish, thread_sensitive=False)(
+            "user.1", {"type": "test"}
+        )
+
+        self.assertEqual(
+            await asyncio.wait_for(subscription.get(), 1), {"type": "test"}
+        )
+
+
+class ChatWebSocketTest(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+
+        self.thread_between_1_and_2, _ = Thread.objects.get_or_create_for_pair(
+            self.user1, self.user2
+        )
+
+    def connect(self, user=None, path="/ws/chat/", token=None):
+        if token is None:
+            token = str(SlidingToken.for_user(user))
+        return ApplicationCommunicator(
+            application,
+            {
+                "type": "websocket",
+                "path": path,
+                "query_string": f"token={token}".encode(),
+                "headers": [],
+            },
+        )
+
+    async def receive_json(self, communicator):
+        output = await communicator.receive_output(1)
+        self.assertEqual(output["type"], "websocket.send")
+        return json.loads(output["text"])
+
+    async def test_reject_invalid_token(self):
+        communicator = self.connect(token="invalid")
+        await communicator.send_input({"type": "websocket.connect"})
+
+        output = await communicator.receive_output(1)
+        self.assertEqual(output, {"type": "websocket.close", "code": 4401})
+
+    async def test_reject_unknown_path(self):
+        communicator = self.connect(self.user1, path="/ws/unknown/")
+        await communicator.send_input({"type": "websocket.connect"})
+
+        output = await communicator.receive_output(1)
+        self.assertEqual(output, {"type": "websocket.close", "code": 4404})
+
+    async def test_ping(self):
+        communicator = self.connect(self.user1)
+        await communicator.send_input({"type": "websocket.connect"})
+        self.assertEqual(
+            await communicator.receive_output(1), {"type": "websocket.accept"}
+        )
+
+        await communicator.send_input(
+            {"type": "websocket.receive", "text": json.dumps({"type": "ping"})}
+        )
+        self.assertEqual(await self.receive_json(communicator), {"type": "pong"})
+
+        await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+        await communicator.wait(1)
+
+    async def test_push_new_message_and_unread_count(self):
+        communicator = self.connect(self.user2)
+        await communicator.send_input({"type": "websocket.connect"})
+        self.assertEqual(
+            await communicator.receive_output(1), {"type": "websocket.accept"}
+        )
+
+        self.client.force_authenticate(user=self.user1)
+        response = await sync_to_async(self.client.post)(
+            reverse("messages", args=[self.thread_between_1_and_2.id]),
+            {"text": "Hello"},
+            format="json",
+        )
+
+        event = await self.receive_json(communicator)
+        self.assertEqual(event["type"], "message.created")
+        self.assertEqual(event["thread_id"], self.thread_between_1_and_2.id)
+        self.assertEqual(event["message"], response.data)
+
+        event = await self.receive_json(communicator)
+        self.assertEqual(
+            event,
+            {
+                "type": "unread_count",
+                "thread_id": self.thread_between_1_and_2.id,
+                "unread_count": 1,
+            },
+        )
+
+        await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+        await communicator.wait(1)
+
+    async def test_push_read_receipt(self):
+        message = await Message.objects.acreate(
+            text="Hello", sender=self.user1, thread=self.thread_between_1_and_2
+        )
+        communicator = self.connect(self.user1)
+        await communicator.send_input({"type": "websocket.connect"})
+        self.assertEqual(
+            await communicator.receive_output(1), {"type": "websocket.accept"}
+        )
+
+        self.client.force_authenticate(user=self.user2)
+        await sync_to_async(self.client.patch)(
+            reverse("messages", args=[self.thread_between_1_and_2.id, message.id]),
+            {"is_read": True},
+        )
+
+        event = await self.receive_json(communicator)
+        self.assertEqual(
+            event,
+            {
+                "type": "messages.read",
+                "thread_id": self.thread_between_1_and_2.id,
+                "reader_id": self.user2.id,
+                "message_id": message.id,
+            },
+        )
+        # The sender's unread count did not change, so no unread_count event for them
+        self.assertTrue(await communicator.receive_nothing(0.1))
+
+        await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+        await communicator.wait(1)
+
+    async def test_push_thread_created_and_deleted(self):
+        user3 = await sync_to_async(User.objects.create_user)(
+            username="user3", password="testpass123"
+        )
+        communicator = self.connect(user3)
+        await communicator.send_input({"type": "websocket.connect"})
+        self.assertEqual(
+            await communicator.receive_output(1), {"type": "websocket.accept"}
+        )
+
+        self.client.force_authenticate(user=self.user1)
+        response = await sync_to_async(self.client.post)(
+            reverse("threads"), {"username": "user3"}, format="json"
+        )
+        thread_id = response.data["id"]
+        self.assertEqual(
+            await self.receive_json(communicator),
+            {"type": "thread.created", "thread_id": thread_id},
+        )
+
+        await sync_to_async(self.client.delete)(
+            reverse("delete_thread", args=[thread_id])
+        )
+        self.assertEqual(
+            await self.receive_json(communicator),
+            {"type": "thread.deleted", "thread_id": thread_id},
+        )
+
+        await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+        await communicator.wait(1)
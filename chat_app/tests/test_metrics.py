@@ -0,0 +1,102 @@
+import itertools
+import re
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import SlidingToken
+
+from chat_app.metrics import registry
+from chat_app.models import Thread, Message
+
+
+@override_settings(CHAT_METRICS_ENABLED=True)
+class MetricsMiddlewareTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+        self.thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        Message.objects.create(text="Hello", sender=self.user2, thread=self.thread)
+        self.client.force_authenticate(user=self.user1)
+
+    def server_timing(self, response):
+        return dict(
+            re.match(r"(\w+);(.*)", entry.strip()).groups()
+            for entry in response.headers["Server-Timing"].split(",")
+        )
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("messages", args=[self.thread.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = self.server_timing(response)
+        self.assertIn(f'desc="{len(queries)} queries"', timing["db"])
+        self.assertIn("dur=", timing["serializer"])
+        self.assertIn("dur=", timing["total"])
+
+    def test_times_message_rows(self):
+        # The message list renders values() rows with MessageRowSerializer
+        with mock.patch(
+            "chat_app.metrics.time.perf_counter", side_effect=itertools.count()
+        ):
+            response = self.client.get(reverse("messages", args=[self.thread.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(self.server_timing(response)["serializer"], "dur=0.00")
+
+    def test_records_queries_of_async_views(self):
+        # The poll view queries the database from a worker thread
+        response = self.client.get(
+            reverse("poll_messages", args=[self.thread.id]),
+            {"since_id": 0},
+            headers={"Authorization": f"Bearer {SlidingToken.for_user(self.user1)}"},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('desc="0 queries"', self.server_timing(response)["db"])
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("messages", args=[self.thread.id]))
+        self.client.get(reverse("messages", args=[self.thread.id]))
+
+        admin = User.objects.create_superuser(username="admin", password="admin")
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn("# TYPE chat_request_duration_seconds histogram", body)
+        self.assertIn(
+            'chat_request_duration_seconds_count{route="api/threads/<int:thread_pk>'
+            '/messages/",method="GET"} 2',
+            body,
+        )
+        self.assertIn("chat_request_db_queries_bucket", body)
+
+    def test_metrics_endpoint_admin_only(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class MetricsDisabledTest(TransactionTestCase):
+    def test_no_server_timing_header(self):
+        user = User.objects.create_user(username="user1", password="testpass123")
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.get(reverse("threads"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Server-Timing", response.headers)
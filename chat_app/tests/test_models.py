@@ -1,9 +1,13 @@
 from django.test import TransactionTestCase
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.contrib.auth.models import User
+from django.urls import reverse
 from chat_app.models import (
     Thread,
+    ThreadParticipant,
     Message,
+    UnreadCounter,
 )
 
 
@@ -14,8 +18,7 @@ class ThreadModelTest(TransactionTestCase):
         self.user3 = User.objects.create_user(username="user3", password="testpass123")
 
     def test_create_valid_thread(self):
-        thread = Thread.objects.create()
-        thread.participants.add(self.user1, self.user2)
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
         self.assertEqual(thread.participants.count(), 2)
         participants = thread.participants.all()
         self.assertIn(self.user1, participants)
@@ -24,20 +27,60 @@ class ThreadModelTest(TransactionTestCase):
         self.assertIsNotNone(thread.updated)
 
     def test_cannot_add_more_than_two_participants(self):
-        thread = Thread.objects.create()
-        thread.participants.add(self.user1, self.user2)
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+
+        # Both slots of the thread are taken
+        for slot in (0, 1):
+            with self.assertRaises(IntegrityError):
+                thread.participants.add(self.user3, through_defaults={"slot": slot})
+        self.assertEqual(thread.participants.count(), 2)
 
-        with self.assertRaisesMessage(
-            ValidationError, "A thread should have not more than 2 participants."
-        ):
-            thread.participants.add(self.user3)
+    def test_participant_slot_out_of_range(self):
+        thread = Thread.objects.create()
+        with self.assertRaises(IntegrityError):
+            ThreadParticipant.objects.create(thread=thread, user=self.user1, slot=2)
 
-    def test_cannot_set_more_than_two_participants_at_once(self):
+    def test_cannot_add_same_participant_twice(self):
         thread = Thread.objects.create()
-        with self.assertRaisesMessage(
-            ValidationError, "A thread should have not more than 2 participants."
-        ):
-            thread.participants.set([self.user1, self.user2, self.user3])
+        ThreadParticipant.objects.create(thread=thread, user=self.user1, slot=0)
+        with self.assertRaises(IntegrityError):
+            ThreadParticipant.objects.create(thread=thread, user=self.user1, slot=1)
+
+    def test_participant_pair_key(self):
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user2, self.user1)
+
+        thread.refresh_from_db()
+        self.assertEqual(thread.participant_low, self.user1)
+        self.assertEqual(thread.participant_high, self.user2)
+
+        thread.participants.remove(self.user2)
+        thread.refresh_from_db()
+        self.assertIsNone(thread.participant_low)
+        self.assertIsNone(thread.participant_high)
+
+        # The free slot can be taken by another user
+        thread.participants.add(self.user3, through_defaults={"slot": 1})
+        thread.refresh_from_db()
+        self.assertEqual(thread.participant_low, self.user1)
+        self.assertEqual(thread.participant_high, self.user3)
+
+    def test_get_or_create_for_pair(self):
+        thread, created = Thread.objects.get_or_create_for_pair(self.user2, self.user1)
+        self.assertTrue(created)
+        self.assertEqual(set(thread.participants.all()), {self.user1, self.user2})
+
+        same_thread, created = Thread.objects.get_or_create_for_pair(
+            self.user1, self.user2
+        )
+        self.assertFalse(created)
+        self.assertEqual(same_thread, thread)
+
+    def test_cannot_create_duplicate_thread_for_pair(self):
+        Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        with self.assertRaises(IntegrityError):
+            Thread.objects.create(
+                participant_low=self.user1, participant_high=self.user2
+            )
 
 
 class MessageModelTest(TransactionTestCase):
@@ -45,8 +88,9 @@ class MessageModelTest(TransactionTestCase):
         self.user1 = User.objects.create_user(username="user1", password="testpass123")
         self.user2 = User.objects.create_user(username="user2", password="testpass123")
 
-        self.thread_between_1_and_2 = Thread.objects.create()
-        self.thread_between_1_and_2.participants.add(self.user1, self.user2)
+        self.thread_between_1_and_2, _ = Thread.objects.get_or_create_for_pair(
+            self.user1, self.user2
+        )
 
     def test_create_message(self):
         message = Message.objects.create(
@@ -62,6 +106,16 @@ class MessageModelTest(TransactionTestCase):
         self.assertEqual(self.thread_between_1_and_2.messages.count(), 1)
         self.assertEqual(self.thread_between_1_and_2.messages.first(), message)
 
+    def test_create_message_updates_thread_last_activity(self):
+        message = Message.objects.create(
+            sender=self.user1, thread=self.thread_between_1_and_2, text="Test message"
+        )
+
+        self.thread_between_1_and_2.refresh_from_db()
+        self.assertEqual(self.thread_between_1_and_2.last_message, message)
+        self.assertEqual(self.thread_between_1_and_2.last_message_at, message.created)
+        self.assertEqual(self.thread_between_1_and_2.updated, message.created)
+
     def test_cannot_create_message_with_non_participant_sender(self):
         user3 = User.objects.create_user(username="user3", password="testpass123")
         with self.assertRaises(ValidationError):
@@ -121,3 +175,137 @@ class MessageModelTest(TransactionTestCase):
 
         # Check, does all messages has been deleted
         self.assertEqual(Message.objects.count(), 0)
+
+
+class UnreadCounterModelTest(TransactionTestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+
+        self.thread_between_1_and_2, _ = Thread.objects.get_or_create_for_pair(
+            self.user1, self.user2
+        )
+
+    def get_count(self, user):
+        return UnreadCounter.objects.get(
+            thread=self.thread_between_1_and_2, user=user
+        ).count
+
+    def test_counters_created_for_participants(self):
+        self.assertEqual(
+            set(
+                UnreadCounter.objects.filter(
+                    thread=self.thread_between_1_and_2
+                ).values_list("user_id", "count")
+            ),
+            {(self.user1.id, 0), (self.user2.id, 0)},
+        )
+
+    def test_message_increments_counter_of_other_participant(self):
+        Message.objects.create(
+            sender=self.user1, thread=self.thread_between_1_and_2, text="Message 1"
+        )
+        Message.objects.create(
+            sender=self.user1, thread=self.thread_between_1_and_2, text="Message 2"
+        )
+
+        self.assertEqual(self.get_count(self.user1), 0)
+        self.assertEqual(self.get_count(self.user2), 2)
+
+    def test_updating_message_does_not_increment_counter(self):
+        message = Message.objects.create(
+            sender=self.user1, thread=self.thread_between_1_and_2, text="Message 1"
+        )
+        message.text = "Edited"
+        message.save()
+
+        self.assertEqual(self.get_count(self.user2), 1)
+
+    def test_counter_removed_with_participant(self):
+        self.thread_between_1_and_2.participants.remove(self.user2)
+
+        self.assertFalse(
+            UnreadCounter.objects.filter(
+                thread=self.thread_between_1_and_2, user=self.user2
+            ).exists()
+        )
+
+    def test_decrement_does_not_go_below_zero(self):
+        UnreadCounter.objects.filter(thread=self.thread_between_1_and_2).decrement(5)
+
+        self.assertEqual(self.get_count(self.user1), 0)
+
+
+class ThreadAdminTest(TransactionTestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+        admin = User.objects.create_superuser(username="admin", password="admin")
+        self.client.force_login(admin)
+
+    def participant_data(self, *rows, initial=0):
+        data = {
+            "threadparticipant_set-TOTAL_FORMS": len(rows),
+            "threadparticipant_set-INITIAL_FORMS": initial,
+            "threadparticipant_set-MIN_NUM_FORMS": 0,
+            "threadparticipant_set-MAX_NUM_FORMS": 2,
+        }
+        for i, row in enumerate(rows):
+            data.update({f"threadparticipant_set-{i}-{k}": v for k, v in row.items()})
+        return data
+
+    def test_add_thread_with_participants(self):
+        # Slots in the reverse order of the ids
+        response = self.client.post(
+            reverse("admin:chat_app_thread_add"),
+            self.participant_data(
+                {"user": self.user2.id, "slot": 0}, {"user": self.user1.id, "slot": 1}
+            ),
+        )
+
+        self.assertEqual(response.status_code, 302)
+        thread = Thread.objects.get()
+        self.assertEqual(
+            (thread.participant_low_id, thread.participant_high_id),
+            (self.user1.id, self.user2.id),
+        )
+        self.assertEqual(
+            set(UnreadCounter.objects.values_list("user_id", flat=True)),
+            {self.user1.id, self.user2.id},
+        )
+        self.assertEqual(
+            Thread.objects.get_or_create_for_pair(self.user1, self.user2),
+            (thread, False),
+        )
+
+    def test_remove_participant(self):
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        rows = ThreadParticipant.objects.filter(thread=thread).order_by("slot")
+        url = reverse("admin:chat_app_thread_change", args=[thread.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        response = self.client.post(
+            url,
+            self.participant_data(
+                *(
+                    {
+                        "id": row.id,
+                        "thread": thread.id,
+                        "user": row.user_id,
+                        "slot": row.slot,
+                        # Removes the participant of slot 1
+                        "DELETE": "on" if row.slot else "",
+                    }
+                    for row in rows
+                ),
+                initial=2,
+            ),
+        )
+
+        self.assertEqual(response.status_code, 302)
+        thread.refresh_from_db()
+        self.assertIsNone(thread.participant_low_id)
+        self.assertEqual(
+            list(UnreadCounter.objects.values_list("user_id", flat=True)),
+            [self.user1.id],
+        )
@@ -0,0 +1,143 @@
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory, TransactionTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from chat_app import search
+from chat_app.models import Thread, Message
+
+
+class MessageSearchTest(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+        self.user3 = User.objects.create_user(username="user3", password="testpass123")
+        self.thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        self.other_thread, _ = Thread.objects.get_or_create_for_pair(
+            self.user1, self.user3
+        )
+        self.foreign_thread, _ = Thread.objects.get_or_create_for_pair(
+            self.user2, self.user3
+        )
+        self.client.force_authenticate(user=self.user1)
+        self.url = reverse("search_messages")
+
+    def create_message(self, text, thread=None, sender=None):
+        return Message.objects.create(
+            text=text, thread=thread or self.thread, sender=sender or self.user2
+        )
+
+    def test_search_ranks_matches_of_user_threads(self):
+        once = self.create_message("Lunch at noon, then the meeting")
+        twice = self.create_message("Meeting moved: the meeting is at three")
+        other = self.create_message(
+            "No meeting today", thread=self.other_thread, sender=self.user3
+        )
+        self.create_message("Lunch?")
+        self.create_message("Meeting", thread=self.foreign_thread)
+
+        response = self.client.get(self.url, {"q": "MEETING"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 3)
+        results = response.data["results"]
+        # More occurrences in a shorter text rank higher
+        self.assertEqual(results[0]["id"], twice.id)
+        self.assertEqual({r["id"] for r in results}, {once.id, twice.id, other.id})
+        self.assertEqual(
+            results[0],
+            {
+                "thread": self.thread.id,
+                "id": twice.id,
+                "sender": {"id": self.user2.id, "username": "user2"},
+                "text": "Meeting moved: the meeting is at three",
+                "is_read": False,
+                "created": results[0]["created"],
+            },
+        )
+
+    def test_search_matches_all_words_and_thread(self):
+        both = self.create_message("Lunch meeting")
+        self.create_message("Lunch")
+        self.create_message(
+            "Lunch meeting", thread=self.other_thread, sender=self.user3
+        )
+
+        response = self.client.get(
+            self.url, {"q": "meeting lunch", "thread": self.thread.id}
+        )
+
+        self.assertEqual([r["id"] for r in response.data["results"]], [both.id])
+
+    def test_search_is_paginated(self):
+        for i in range(15):
+            self.create_message(f"Report {i}")
+
+        response = self.client.get(self.url, {"q": "report", "limit": 10})
+
+        self.assertEqual(response.data["count"], 15)
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertIsNotNone(response.data["next"])
+
+    def test_query_syntax_is_not_interpreted(self):
+        quoted = self.create_message('She said "fine" OR not')
+
+        for q in ('"fine"', "fine OR", "NEAR(", "*", "-"):
+            response = self.client.get(self.url, {"q": q})
+            self.assertEqual(response.status_code, status.HTTP_200_OK, q)
+        response = self.client.get(self.url, {"q": '"fine" OR'})
+        self.assertEqual([r["id"] for r in response.data["results"]], [quoted.id])
+
+    def test_invalid_parameters(self):
+        for params in (
+            {},
+            {"q": "  "},
+            {"q": "hello", "thread": "x"},
+            # Not a decimal digit, although str.isdigit() accepts it
+            {"q": "hello", "thread": "²"},
+        ):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_follows_updates_and_deletes(self):
+        message = self.create_message("Old text")
+        message.text = "New text"
+        message.save()
+        # Read state changes do not touch the index
+        Message.objects.filter(pk=message.pk).update(is_read=True)
+
+        old = search.search_messages(Message.objects.all(), "old", connection.vendor)
+        new = search.search_messages(Message.objects.all(), "new", connection.vendor)
+        self.assertFalse(old.exists())
+        self.assertEqual(list(new), [message])
+
+        message.delete()
+        self.assertFalse(new.all().exists())
+
+    def test_admin_search(self):
+        by_user3 = self.create_message(
+            "Hi", thread=self.other_thread, sender=self.user3
+        )
+        match = self.create_message("Say hi to user3")
+        self.create_message("Hello")
+        renamed = User.objects.create_user(username="old_user3", password="x")
+        Thread.objects.get_or_create_for_pair(self.user1, renamed)
+        by_renamed = self.create_message(
+            "Hi", thread=Thread.objects.get(participant_high=renamed), sender=renamed
+        )
+        admin = User.objects.create_superuser(username="admin", password="admin")
+        request = RequestFactory().get("/")
+        request.user = admin
+        model_admin = site._registry[Message]
+
+        queryset, may_have_duplicates = model_admin.get_search_results(
+            request, Message.objects.all(), "user3"
+        )
+
+        # Usernames are matched by substring like the default admin search
+        self.assertEqual(set(queryset), {by_user3, by_renamed, match})
+        self.assertFalse(may_have_duplicates)
@@ -1,10 +1,13 @@
 from django.contrib.auth.models import User
-from django.test import TransactionTestCase, RequestFactory
+from django.test import TransactionTestCase, RequestFactory, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
 from chat_app.models import Thread, Message
 from chat_app.serializers import (
     UserSerializer,
     ThreadSerializer,
     ThreadMessageSerializer,
+    MessageRowSerializer,
 )
 
 
@@ -85,8 +88,7 @@ class ThreadSerializerTest(TransactionTestCase):
         )
 
     def test_create_existing_thread(self):
-        thread = Thread.objects.create()
-        thread.participants.set([self.user1, self.user2])
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
 
         request = self.factory.post("/api/threads/")
         request.user = self.user1
@@ -114,8 +116,7 @@ class ThreadSerializerTest(TransactionTestCase):
         self.assertEqual(serializer.data, expected_data)
 
     def test_serialize_existing_thread(self):
-        thread = Thread.objects.create()
-        thread.participants.set([self.user1, self.user2])
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
         serializer = ThreadSerializer(instance=thread)
         expected_data = {
             "id": thread.id,
@@ -137,9 +138,9 @@ class ThreadMessageSerializerTest(TransactionTestCase):
         self.user2 = User.objects.create_user(username="user2", password="testpass123")
         self.user3 = User.objects.create_user(username="user3", password="testpass123")
 
-        self.thread_between_1_and_2 = Thread.objects.create()
-
-        self.thread_between_1_and_2.participants.set([self.user1, self.user2])
+        self.thread_between_1_and_2, _ = Thread.objects.get_or_create_for_pair(
+            self.user1, self.user2
+        )
 
         self.valid_request_data = {"text": "Test message123123123"}
         self.no_field_request_data = {}
@@ -311,3 +312,35 @@ class ThreadMessageSerializerTest(TransactionTestCase):
         self.assertIn(
             "Sender must be a participant of the thread.", serializer.errors["detail"]
         )
+
+
+class MessageRowSerializerTest(TransactionTestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password123")
+        self.user2 = User.objects.create_user(username="usér2", password="password123")
+        self.thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        for i, text in enumerate(["Hello", "Привет 👋", 'Quote " and \\ backslash']):
+            Message.objects.create(
+                text=text,
+                sender=self.user1 if i % 2 else self.user2,
+                thread=self.thread,
+                is_read=bool(i % 2),
+            )
+
+    def render_both(self):
+        messages = Message.objects.select_related("sender").order_by("id")
+        rows = messages.values(*MessageRowSerializer.values_fields)
+        return (
+            JSONRenderer().render(ThreadMessageSerializer(messages, many=True).data),
+            JSONRenderer().render(MessageRowSerializer(rows, many=True).data),
+        )
+
+    def test_same_json_as_thread_message_serializer(self):
+        expected, actual = self.render_both()
+        self.assertEqual(actual, expected)
+
+    @override_settings(TIME_ZONE="Asia/Kolkata")
+    def test_same_json_in_other_time_zone(self):
+        with timezone.override("Asia/Kolkata"):
+            expected, actual = self.render_both()
+        self.assertEqual(actual, expected)
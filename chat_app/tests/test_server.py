@@ -0,0 +1,86 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+
+class GunicornSmokeTest(SimpleTestCase):
+    """Boots the production server of gunicorn.conf.py and sends it a few requests."""
+
+    def setUp(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn"],
+            cwd=settings.BASE_DIR,
+            env={
+                **os.environ,
+                "GUNICORN_BIND": f"127.0.0.1:{self.port}",
+                "WEB_CONCURRENCY": "2",
+                "DATABASE_URL": f"sqlite:///{directory.name}/db.sqlite3",
+            },
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        self.addCleanup(self.server.kill)
+        # Read by a thread, a full pipe would block the server
+        self.output = []
+        self.reader = threading.Thread(target=self.read_output, daemon=True)
+        self.reader.start()
+
+    def read_output(self):
+        for line in self.server.stdout:
+            self.output.append(line)
+
+    def wait_for_output(self, text, count, timeout=30):
+        deadline = time.monotonic() + timeout
+        while sum(text in line for line in list(self.output)) < count:
+            if time.monotonic() > deadline or self.server.poll() is not None:
+                self.fail("".join(self.output))
+            time.sleep(0.2)
+
+    def get(self, path, timeout=30):
+        # Retries until the server accepts connections
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with urlopen(f"http://127.0.0.1:{self.port}{path}") as response:
+                    return response.status, json.load(response)
+            except HTTPError as error:
+                return error.code, json.load(error)
+            except URLError:
+                if time.monotonic() > deadline or self.server.poll() is not None:
+                    raise
+                time.sleep(0.2)
+
+    def test_server_boots_and_shuts_down(self):
+        status, data = self.get("/api/threads/")
+        self.assertEqual(status, 401)
+        self.assertIn("detail", data)
+
+        status, data = self.get("/no-such-page/")
+        self.assertEqual(status, 404)
+        self.assertEqual(data["status_code"], 404)
+
+        # Both workers, the second one may still be booting after the first responded
+        self.wait_for_output("loaded the application in", 2)
+        self.server.terminate()
+        self.server.wait(timeout=60)
+        self.reader.join(timeout=60)
+        output = "".join(self.output)
+        self.assertEqual(self.server.returncode, 0, output)
+        self.assertIn("Server ready in", output)
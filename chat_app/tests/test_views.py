@@ -1,13 +1,41 @@
+import asyncio
+import csv
+import io
+import json
+import time
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
-from django.test import TransactionTestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from rest_framework.test import APIClient
 from rest_framework import status
+from rest_framework_simplejwt.tokens import SlidingToken
 from chat_app.models import Thread, Message
+from chat_app.serializers import MessageRowSerializer
+from chat_app.views import ThreadViewSet, ThreadMessageViewSet
+
+
+def statements(queries):
+    # SQLite logs the BEGIN/COMMIT/ROLLBACK of atomic blocks, other backends do not
+    return [
+        query["sql"]
+        for query in queries.captured_queries
+        if not query["sql"].startswith(("BEGIN", "COMMIT", "ROLLBACK"))
+    ]
 
 
 class ThreadViewSetTest(TransactionTestCase):
     def setUp(self):
+        # Ids are reused after the database is flushed, pages of earlier tests would match
+        cache.clear()
         self.client = APIClient()
         self.user1 = User.objects.create_user(username="user1", password="testpass123")
         self.user2 = User.objects.create_user(username="user2", password="testpass123")
@@ -36,8 +64,7 @@ class ThreadViewSetTest(TransactionTestCase):
         self.assertEqual(Thread.objects.count(), 1)
 
     def test_create_thread_already_exists(self):
-        thread = Thread.objects.create()
-        thread.participants.set([self.user1, self.user2])
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
         response = self.client.post(
             self.threads_url, {"username": self.user2.username}, format="json"
         )
@@ -81,8 +108,7 @@ class ThreadViewSetTest(TransactionTestCase):
         )
 
     def test_delete_thread_success(self):
-        thread = Thread.objects.create()
-        thread.participants.set([self.user1, self.user2])
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
         delete_url = reverse("delete_thread", args=[thread.id])
         response = self.client.delete(delete_url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
@@ -98,8 +124,7 @@ class ThreadViewSetTest(TransactionTestCase):
         )
 
     def test_delete_thread_not_participant(self):
-        thread = Thread.objects.create()
-        thread.participants.set([self.user2, self.user3])
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user2, self.user3)
 
         delete_url = reverse("delete_thread", args=[thread.id])
         response = self.client.delete(delete_url)
@@ -107,35 +132,149 @@ class ThreadViewSetTest(TransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertEqual("No Thread matches the given query.", response.data["detail"])
 
+    @override_settings(CHAT_READ_DATABASE="replica")
+    def test_read_actions_use_read_database(self):
+        for action, alias in (
+            ("list", "replica"),
+            ("inbox", "replica"),
+            ("create", "default"),
+            ("destroy", "default"),
+        ):
+            view = ThreadViewSet(action=action)
+            queryset = view.filter_queryset(Thread.objects.all())
+            self.assertEqual(queryset.db, alias, action)
+
     def test_list_threads(self):
-        thread1 = Thread.objects.create()
-        thread1.participants.set([self.user1, self.user2])
+        thread1, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
 
-        thread2 = Thread.objects.create()
-        thread2.participants.set([self.user1, self.user3])
+        thread2, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user3)
 
         # Thread without user 1 that logged in - this user should not see a thread between user2 and user3
-        thread3 = Thread.objects.create()
-        thread3.participants.set([self.user2, self.user3])
+        thread3, _ = Thread.objects.get_or_create_for_pair(self.user2, self.user3)
 
         response = self.client.get(self.threads_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         thread_ids = [thread["id"] for thread in response.data["results"]]
         self.assertEqual(set(thread_ids), {thread1.id, thread2.id})
 
+    def test_list_threads_ordered_by_last_activity(self):
+        older_thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        newer_thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user3)
+
+        Message.objects.create(text="Hi", sender=self.user2, thread=older_thread)
+
+        response = self.client.get(self.threads_url)
+        thread_ids = [thread["id"] for thread in response.data["results"]]
+        self.assertEqual(thread_ids, [older_thread.id, newer_thread.id])
+
+    def test_list_threads_cursor_pagination(self):
+        threads = []
+        for user in (self.user2, self.user3):
+            thread, _ = Thread.objects.get_or_create_for_pair(self.user1, user)
+            threads.append(thread)
+
+        response = self.client.get(
+            self.threads_url, {"pagination": "cursor", "limit": 1}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("count", response.data)
+        self.assertEqual([t["id"] for t in response.data["results"]], [threads[1].id])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([t["id"] for t in response.data["results"]], [threads[0].id])
+        self.assertIsNone(response.data["next"])
+
+
+class InboxViewTest(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+        self.user3 = User.objects.create_user(username="user3", password="testpass123")
+
+        self.client.force_authenticate(user=self.user1)
+        self.inbox_url = reverse("inbox")
+
+    def create_thread(self, user):
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user1, user)
+        return thread
+
+    def test_inbox_ordered_by_last_activity(self):
+        thread_with_2 = self.create_thread(self.user2)
+        thread_with_3 = self.create_thread(self.user3)
+        Message.objects.create(text="Hi", sender=self.user2, thread=thread_with_2)
+        last_message = Message.objects.create(
+            text="Hello", sender=self.user2, thread=thread_with_2
+        )
+
+        response = self.client.get(self.inbox_url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data["results"]
+        # The thread with the latest message goes first, even though it is older
+        self.assertEqual(
+            [thread["id"] for thread in results], [thread_with_2.id, thread_with_3.id]
+        )
+        self.assertEqual(results[0]["last_message"]["id"], last_message.id)
+        self.assertEqual(results[0]["last_message"]["text"], "Hello")
+        self.assertEqual(
+            results[0]["last_message"]["sender"],
+            {"id": self.user2.id, "username": "user2"},
+        )
+        self.assertEqual(results[0]["unread_count"], 2)
+        self.assertIsNone(results[1]["last_message"])
+        self.assertEqual(results[1]["unread_count"], 0)
+
+    def test_inbox_queries_do_not_depend_on_thread_count(self):
+        thread = self.create_thread(self.user2)
+        Message.objects.create(text="Hi", sender=self.user2, thread=thread)
+        # Count, threads page with the last messages and participants
+        with self.assertNumQueries(3):
+            self.client.get(self.inbox_url)
+
+        for user in (self.user3, User.objects.create_user(username="user4")):
+            thread = self.create_thread(user)
+            Message.objects.create(text="Hi", sender=user, thread=thread)
+        with self.assertNumQueries(3):
+            response = self.client.get(self.inbox_url)
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_inbox_cursor_pagination(self):
+        threads = [self.create_thread(user) for user in (self.user2, self.user3)]
+        Message.objects.create(text="Hi", sender=self.user2, thread=threads[0])
+
+        response = self.client.get(self.inbox_url, {"pagination": "cursor", "limit": 1})
+        self.assertEqual([t["id"] for t in response.data["results"]], [threads[0].id])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual([t["id"] for t in response.data["results"]], [threads[1].id])
+        self.assertIsNone(response.data["next"])
+
+    def test_inbox_only_own_threads(self):
+        thread, _ = Thread.objects.get_or_create_for_pair(self.user2, self.user3)
+
+        response = self.client.get(self.inbox_url)
+
+        self.assertEqual(response.data["results"], [])
+
 
 class ThreadMessageViewSetTest(TransactionTestCase):
     def setUp(self):
+        # Ids are reused after the database is flushed, pages of earlier tests would match
+        cache.clear()
         self.client = APIClient()
         self.user1 = User.objects.create_user(username="user1", password="testpass123")
         self.user2 = User.objects.create_user(username="user2", password="testpass123")
         self.user3 = User.objects.create_user(username="user3", password="testpass123")
 
-        self.thread_between_1_and_2 = Thread.objects.create()
-        self.thread_between_1_and_2.participants.set([self.user1, self.user2])
+        self.thread_between_1_and_2, _ = Thread.objects.get_or_create_for_pair(
+            self.user1, self.user2
+        )
 
-        self.thread_between_2_and_3 = Thread.objects.create()
-        self.thread_between_2_and_3.participants.set([self.user2, self.user3])
+        self.thread_between_2_and_3, _ = Thread.objects.get_or_create_for_pair(
+            self.user2, self.user3
+        )
 
         self.client.force_authenticate(user=self.user1)
 
@@ -165,6 +304,53 @@ class ThreadMessageViewSetTest(TransactionTestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Message.objects.count(), 1)
 
+    def test_create_thread_message_query_count(self):
+        # Participation check, INSERT, unread counters, thread last activity
+        # and the unread counts for the real-time events
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                self.messages_url, self.valid_request_data, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(statements(queries)), 5)
+
+    def test_create_thread_message_retry_with_client_id(self):
+        data = {"text": "Hello", "client_id": "3f2b"}
+        first = self.client.post(self.messages_url, data, format="json")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("client_id", first.data)
+
+        # Failed INSERT and the lookup of the existing message, no side effects
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.messages_url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, first.data)
+        self.assertEqual(len(statements(queries)), 3)
+        self.assertEqual(Message.objects.count(), 1)
+
+        unread_count_url = reverse(
+            "unread_count", args=[self.thread_between_1_and_2.id]
+        )
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.client.get(unread_count_url).data["unread_count"], 1)
+
+        # Same key of another sender, and messages without a key are never deduplicated
+        response = self.client.post(self.messages_url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        for _ in range(2):
+            response = self.client.post(
+                self.messages_url, {"text": "Hello"}, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Message.objects.count(), 4)
+
+    def test_create_thread_message_too_long_client_id(self):
+        response = self.client.post(
+            self.messages_url, {"text": "Hello", "client_id": "x" * 65}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("client_id", response.data)
+
     def test_create_thread_message_no_field_data(self):
         response = self.client.post(
             self.messages_url, self.no_field_request_data, format="json"
@@ -190,13 +376,14 @@ class ThreadMessageViewSetTest(TransactionTestCase):
         self.assertEqual("This field may not be null.", response.data["text"][0])
 
     def test_create_thread_message_thread_does_not_exits(self):
-        non_existent_messages_url = reverse("messages", args=[100])
+        # Far above the ids of the threads created by all tests, SQLite never reuses them
+        non_existent_messages_url = reverse("messages", args=[999999])
         response = self.client.post(
             non_existent_messages_url, self.valid_request_data, format="json"
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("detail", response.data)
-        self.assertIn("Thread with id 100 does not exist.", response.data["detail"])
+        self.assertIn("Thread with id 999999 does not exist.", response.data["detail"])
 
     def test_create_thread_message_not_in_your_thread(self):
         another_thread_messages_url = reverse(
@@ -246,6 +433,42 @@ class ThreadMessageViewSetTest(TransactionTestCase):
         message.refresh_from_db()
         self.assertTrue(message.is_read)
 
+    def test_mark_thread_message_as_read_decrements_unread_count(self):
+        message = Message.objects.create(
+            text="Test message123123123",
+            sender=self.user2,
+            thread=self.thread_between_1_and_2,
+        )
+        patch_url = reverse(
+            "messages", args=[self.thread_between_1_and_2.pk, message.pk]
+        )
+        unread_count_url = reverse(
+            "unread_count", args=[self.thread_between_1_and_2.id]
+        )
+        self.assertEqual(self.client.get(unread_count_url).data["unread_count"], 1)
+
+        self.client.patch(patch_url, {"is_read": True})
+        # Marking an already read message again does not change the counter
+        self.client.patch(patch_url, {"is_read": True})
+
+        self.assertEqual(self.client.get(unread_count_url).data["unread_count"], 0)
+
+    def test_mark_thread_message_as_read_query_count(self):
+        message = Message.objects.create(
+            text="Test message123123123",
+            sender=self.user2,
+            thread=self.thread_between_1_and_2,
+        )
+        patch_url = reverse(
+            "messages", args=[self.thread_between_1_and_2.pk, message.pk]
+        )
+        # Message lookup, conditional UPDATE, unread counters, read state of the thread
+        # and the unread counts for the real-time events
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(patch_url, {"is_read": True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(statements(queries)), 5)
+
     def test_try_to_patch_other_fields_from_api_for_mark_thread_message_as_read(self):
         message = Message.objects.create(
             text="Test message123123123",
@@ -315,6 +538,188 @@ class ThreadMessageViewSetTest(TransactionTestCase):
         self.assertIn("detail", response.data)
         self.assertEqual("No Message matches the given query.", response.data["detail"])
 
+    @override_settings(CHAT_READ_DATABASE="replica")
+    def test_read_actions_use_read_database(self):
+        for action, alias in (
+            ("list", "replica"),
+            ("create", "default"),
+            ("partial_update", "default"),
+        ):
+            view = ThreadMessageViewSet(action=action)
+            queryset = view.filter_queryset(Message.objects.all())
+            self.assertEqual(queryset.db, alias, action)
+
+    def test_list_thread_messages_query_count(self):
+        for i in range(5):
+            Message.objects.create(
+                text=f"Message {i}",
+                sender=self.user2,
+                thread=self.thread_between_1_and_2,
+            )
+        # Thread validators, count and the page of messages with their senders
+        with self.assertNumQueries(3):
+            response = self.client.get(self.messages_url)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_list_thread_messages_cursor_pagination(self):
+        messages = [
+            Message.objects.create(
+                text=f"Message {i}",
+                sender=self.user2,
+                thread=self.thread_between_1_and_2,
+            )
+            for i in range(15)
+        ]
+        # Newest messages first
+        expected_ids = [message.id for message in reversed(messages)]
+
+        response = self.client.get(self.messages_url, {"pagination": "cursor"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("count", response.data)
+        first_page_ids = [m["id"] for m in response.data["results"]]
+        self.assertEqual(first_page_ids, expected_ids[:10])
+        self.assertIsNotNone(response.data["next"])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([m["id"] for m in response.data["results"]], expected_ids[10:])
+        self.assertIsNone(response.data["next"])
+
+    def test_list_thread_messages_cursor_pagination_with_new_messages(self):
+        for i in range(12):
+            Message.objects.create(
+                text=f"Message {i}",
+                sender=self.user2,
+                thread=self.thread_between_1_and_2,
+            )
+        first_page = self.client.get(
+            self.messages_url, {"pagination": "cursor", "limit": 5}
+        ).data
+
+        new_message = Message.objects.create(
+            text="New message", sender=self.user2, thread=self.thread_between_1_and_2
+        )
+
+        # A message posted meanwhile does not shift the older pages
+        second_page = self.client.get(first_page["next"]).data
+        first_page_ids = {m["id"] for m in first_page["results"]}
+        second_page_ids = {m["id"] for m in second_page["results"]}
+        self.assertEqual(len(second_page_ids), 5)
+        self.assertFalse(first_page_ids & second_page_ids)
+
+        # and is returned when asking for messages newer than the first page
+        newer_page = self.client.get(first_page["previous"]).data
+        self.assertEqual([m["id"] for m in newer_page["results"]], [new_message.id])
+
+        # Nothing newer yet, but the previous link can be polled again later
+        empty_page = self.client.get(newer_page["previous"]).data
+        self.assertEqual(empty_page["results"], [])
+        self.assertIsNotNone(empty_page["previous"])
+
+    def test_list_thread_messages_invalid_cursor(self):
+        response = self.client.get(
+            self.messages_url, {"pagination": "cursor", "before": "not-a-cursor"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual("Invalid cursor.", response.data["detail"])
+
+    def test_mark_thread_read_up_to_message(self):
+        messages = [
+            Message.objects.create(
+                text=f"Message {i}",
+                sender=self.user2,
+                thread=self.thread_between_1_and_2,
+            )
+            for i in range(5)
+        ]
+        own_message = Message.objects.create(
+            text="Own message", sender=self.user1, thread=self.thread_between_1_and_2
+        )
+        url = reverse("mark_read", args=[self.thread_between_1_and_2.id])
+
+        response = self.client.post(url, {"up_to_id": messages[2].id}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"marked": 3, "unread_count": 2})
+        read_ids = set(
+            Message.objects.filter(is_read=True).values_list("id", flat=True)
+        )
+        self.assertEqual(read_ids, {message.id for message in messages[:3]})
+        own_message.refresh_from_db()
+        self.assertFalse(own_message.is_read)
+
+        unread_count_url = reverse(
+            "unread_count", args=[self.thread_between_1_and_2.id]
+        )
+        self.assertEqual(self.client.get(unread_count_url).data["unread_count"], 2)
+
+    def test_mark_thread_read_up_to_timestamp(self):
+        for i in range(3):
+            Message.objects.create(
+                text=f"Message {i}",
+                sender=self.user2,
+                thread=self.thread_between_1_and_2,
+            )
+        latest = Message.objects.latest("created")
+        url = reverse("mark_read", args=[self.thread_between_1_and_2.id])
+
+        response = self.client.post(
+            url, {"up_to": latest.created.isoformat()}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"marked": 3, "unread_count": 0})
+
+    def test_mark_thread_read_up_to_displayed_timestamp(self):
+        messages = [
+            Message.objects.create(
+                text=f"Message {i}",
+                sender=self.user2,
+                thread=self.thread_between_1_and_2,
+            )
+            for i in range(3)
+        ]
+        # Two messages within the same second, the last one a second later
+        second = messages[0].created.replace(microsecond=0)
+        for message, created in zip(
+            messages,
+            [
+                second.replace(microsecond=100),
+                second.replace(microsecond=900000),
+                second + timedelta(seconds=1),
+            ],
+        ):
+            Message.objects.filter(pk=message.pk).update(created=created)
+        listed = self.client.get(
+            reverse("messages", args=[self.thread_between_1_and_2.id])
+        ).data["results"]
+        displayed = next(m["created"] for m in listed if m["id"] == messages[1].id)
+        url = reverse("mark_read", args=[self.thread_between_1_and_2.id])
+
+        response = self.client.post(url, {"up_to": displayed}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {"marked": 2, "unread_count": 1})
+
+    def test_mark_thread_read_without_limit(self):
+        url = reverse("mark_read", args=[self.thread_between_1_and_2.id])
+        response = self.client.post(url, {}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            "Either 'up_to_id' or 'up_to' is required.", response.data["detail"][0]
+        )
+
+    def test_mark_thread_read_non_participant(self):
+        Message.objects.create(
+            text="Message", sender=self.user3, thread=self.thread_between_2_and_3
+        )
+        url = reverse("mark_read", args=[self.thread_between_2_and_3.id])
+        response = self.client.post(url, {"up_to_id": 1000}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Message.objects.filter(is_read=True).exists())
+
     def test_unread_count(self):
         Message.objects.create(
             text="Message 1",
@@ -359,3 +764,374 @@ class ThreadMessageViewSetTest(TransactionTestCase):
             "You are not a participant of this thread or the thread does not exist.",
             response.data["detail"],
         )
+
+    def test_list_thread_messages_conditional_get(self):
+        message = Message.objects.create(
+            text="Message 1", sender=self.user2, thread=self.thread_between_1_and_2
+        )
+        # Last-Modified is only sent once the second of the last change is over
+        Thread.objects.filter(pk=self.thread_between_1_and_2.pk).update(
+            last_message_at=timezone.now() - timedelta(seconds=2)
+        )
+        response = self.client.get(self.messages_url)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+
+        # Only the thread validators are queried
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                self.messages_url, headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(
+            self.messages_url, headers={"If-Modified-Since": last_modified}
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch(
+            reverse("messages", args=[self.thread_between_1_and_2.id, message.id]),
+            {"is_read": True},
+        )
+        response = self.client.get(self.messages_url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data["results"][0]["is_read"])
+
+    def test_list_thread_messages_etag_changes_with_late_message(self):
+        Message.objects.create(
+            text="Message 1", sender=self.user2, thread=self.thread_between_1_and_2
+        )
+        etag = self.client.get(self.messages_url)["ETag"]
+
+        # A message committed after a newer one leaves the last message of the thread
+        thread = Thread.objects.values("last_message", "last_message_at").get(
+            pk=self.thread_between_1_and_2.pk
+        )
+        Message.objects.create(
+            text="Message 2", sender=self.user2, thread=self.thread_between_1_and_2
+        )
+        Thread.objects.filter(pk=self.thread_between_1_and_2.pk).update(**thread)
+
+        response = self.client.get(self.messages_url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 2)
+
+    def test_unread_count_conditional_get(self):
+        url = reverse("unread_count", args=[self.thread_between_1_and_2.id])
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.force_authenticate(user=self.user2)
+        self.client.post(self.messages_url, {"text": "Hello"}, format="json")
+
+        self.client.force_authenticate(user=self.user1)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["unread_count"], 1)
+
+    def test_last_modified_waits_for_the_second_to_end(self):
+        url = reverse("unread_count", args=[self.thread_between_1_and_2.id])
+        Message.objects.create(
+            text="Hello", sender=self.user2, thread=self.thread_between_1_and_2
+        )
+        changed = Thread.objects.get(pk=self.thread_between_1_and_2.pk).last_message_at
+
+        # Another message may still arrive in the same second, If-Modified-Since could
+        # not tell it apart, so the ETag is the only validator
+        with mock.patch("chat_app.views.timezone.now", return_value=changed):
+            response = self.client.get(url)
+        self.assertNotIn("Last-Modified", response)
+
+        later = changed.replace(microsecond=0) + timedelta(seconds=1)
+        with mock.patch("chat_app.views.timezone.now", return_value=later):
+            response = self.client.get(url)
+        self.assertEqual(response["Last-Modified"], http_date(changed.timestamp()))
+
+    def test_batch_create_messages(self):
+        url = reverse("batch_messages", args=[self.thread_between_1_and_2.id])
+        data = {
+            "messages": [
+                {"text": "First", "client_id": "a"},
+                {"text": "Second"},
+                {"text": "Third", "client_id": "b"},
+            ]
+        }
+
+        # Participation check, client id lookup, INSERT, unread counters, thread last
+        # activity and the unread counts for the real-time events
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(statements(queries)), 6)
+        self.assertEqual(
+            [message["text"] for message in response.data],
+            ["First", "Second", "Third"],
+        )
+        self.assertEqual(
+            response.data[0]["sender"], {"id": self.user1.id, "username": "user1"}
+        )
+        self.thread_between_1_and_2.refresh_from_db()
+        self.assertEqual(
+            self.thread_between_1_and_2.last_message_id, response.data[2]["id"]
+        )
+        unread_count_url = reverse(
+            "unread_count", args=[self.thread_between_1_and_2.id]
+        )
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.client.get(unread_count_url).data["unread_count"], 3)
+
+    def test_batch_retry_does_not_duplicate(self):
+        url = reverse("batch_messages", args=[self.thread_between_1_and_2.id])
+        first = self.client.post(
+            url, {"messages": [{"text": "First", "client_id": "a"}]}, format="json"
+        )
+
+        data = {
+            "messages": [
+                {"text": "First", "client_id": "a"},
+                {"text": "Second", "client_id": "b"},
+            ]
+        }
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data[0], first.data[0])
+
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Message.objects.count(), 2)
+        unread_count_url = reverse(
+            "unread_count", args=[self.thread_between_1_and_2.id]
+        )
+        self.client.force_authenticate(user=self.user2)
+        self.assertEqual(self.client.get(unread_count_url).data["unread_count"], 2)
+
+        # Client ids belong to the sender
+        response = self.client.post(url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Message.objects.count(), 4)
+
+    def test_batch_invalid_data(self):
+        url = reverse("batch_messages", args=[self.thread_between_1_and_2.id])
+        invalid = [
+            {},
+            {"messages": []},
+            {"messages": [{"text": ""}]},
+            {"messages": [{"text": "x", "client_id": "a"}] * 2},
+            {"messages": [{"text": "x"}] * 501},
+        ]
+        for data in invalid:
+            response = self.client.post(url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        url = reverse("batch_messages", args=[self.thread_between_2_and_3.id])
+        response = self.client.post(url, {"messages": [{"text": "x"}]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            "Sender must be a participant of the thread.", response.data["detail"][0]
+        )
+        self.assertFalse(Message.objects.exists())
+
+
+class PollThreadMessagesViewTest(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+        self.user3 = User.objects.create_user(username="user3", password="testpass123")
+
+        self.thread_between_1_and_2, _ = Thread.objects.get_or_create_for_pair(
+            self.user1, self.user2
+        )
+
+        self.poll_url = reverse("poll_messages", args=[self.thread_between_1_and_2.id])
+        self.headers = {"Authorization": f"Bearer {SlidingToken.for_user(self.user1)}"}
+
+    async def test_return_existing_messages_immediately(self):
+        old_message = await Message.objects.acreate(
+            text="Old", sender=self.user2, thread=self.thread_between_1_and_2
+        )
+        new_message = await Message.objects.acreate(
+            text="New", sender=self.user2, thread=self.thread_between_1_and_2
+        )
+
+        response = await self.async_client.get(
+            self.poll_url, {"since_id": old_message.id}, headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [m["id"] for m in response.json()["results"]], [new_message.id]
+        )
+
+    async def test_wait_for_new_message(self):
+        self.client.force_authenticate(user=self.user2)
+
+        async def post_message():
+            # Let the poll request subscribe first
+            await asyncio.sleep(0.2)
+            return await sync_to_async(self.client.post)(
+                reverse("messages", args=[self.thread_between_1_and_2.id]),
+                {"text": "Hello"},
+                format="json",
+            )
+
+        started = time.monotonic()
+        poll_response, post_response = await asyncio.gather(
+            self.async_client.get(
+                self.poll_url, {"since_id": 0, "timeout": 5}, headers=self.headers
+            ),
+            post_message(),
+        )
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(poll_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(poll_response.json()["results"], [post_response.data])
+
+    async def test_timeout_without_new_messages(self):
+        response = await self.async_client.get(
+            self.poll_url, {"since_id": 0, "timeout": 0.1}, headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"results": []})
+
+    async def test_poll_unauthorized(self):
+        response = await self.async_client.get(self.poll_url, {"since_id": 0})
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_poll_invalid_since_id(self):
+        response = await self.async_client.get(
+            self.poll_url, {"since_id": "abc"}, headers=self.headers
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_poll_non_participant(self):
+        headers = {"Authorization": f"Bearer {SlidingToken.for_user(self.user3)}"}
+        response = await self.async_client.get(
+            self.poll_url, {"since_id": 0}, headers=headers
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(
+            "You are not a participant of this thread or the thread does not exist.",
+            response.json()["detail"],
+        )
+
+
+class ThreadTranscriptViewTest(TransactionTestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="testpass123")
+        self.user2 = User.objects.create_user(username="user2", password="testpass123")
+        self.user3 = User.objects.create_user(username="user3", password="testpass123")
+        self.thread, _ = Thread.objects.get_or_create_for_pair(self.user1, self.user2)
+        self.messages = [
+            Message.objects.create(
+                text=f'Message {i}, "quoted"\nline',
+                sender=(self.user1, self.user2)[i % 2],
+                thread=self.thread,
+            )
+            for i in range(5)
+        ]
+        # Equal timestamps are ordered by id, also across pages
+        Message.objects.filter(pk__in=[m.pk for m in self.messages[1:4]]).update(
+            created=self.messages[1].created
+        )
+        self.url = reverse("transcript", args=[self.thread.id])
+        self.headers = {"Authorization": f"Bearer {SlidingToken.for_user(self.user1)}"}
+
+    async def download(self, params=None, headers=None):
+        response = await self.async_client.get(
+            self.url, params or {}, headers=headers or self.headers
+        )
+        if not response.streaming:
+            return response, None
+        content = b"".join([chunk async for chunk in response.streaming_content])
+        return response, content.decode()
+
+    async def test_ndjson_transcript(self):
+        # Pages of two messages
+        with mock.patch("chat_app.views.TRANSCRIPT_CHUNK_SIZE", 2):
+            response, content = await self.download()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertIn(
+            f"thread-{self.thread.id}.ndjson", response["Content-Disposition"]
+        )
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([line["id"] for line in lines], [m.id for m in self.messages])
+        # Same message format as the message list
+        messages = await sync_to_async(
+            lambda: list(
+                Message.objects.filter(thread=self.thread)
+                .order_by("created", "id")
+                .values(*MessageRowSerializer.values_fields)
+            )
+        )()
+        self.assertEqual(lines, MessageRowSerializer(messages, many=True).data)
+
+    async def test_csv_transcript(self):
+        with mock.patch("chat_app.views.TRANSCRIPT_CHUNK_SIZE", 2):
+            response, content = await self.download({"output": "csv"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(
+            rows[0],
+            ["id", "sender_id", "sender_username", "text", "is_read", "created"],
+        )
+        self.assertEqual(
+            [int(row[0]) for row in rows[1:]], [m.id for m in self.messages]
+        )
+        self.assertEqual(
+            rows[1][1:5], [str(self.user1.id), "user1", self.messages[0].text, "False"]
+        )
+
+    async def test_csv_formulas_are_text(self):
+        await Message.objects.acreate(
+            text='=HYPERLINK("http://example.com")',
+            sender=self.user1,
+            thread=self.thread,
+        )
+
+        _, content = await self.download({"output": "csv"})
+
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[-1][3], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(rows[1][3], self.messages[0].text)
+
+    def test_wsgi_transcript_is_streamed(self):
+        # The sync test client is a WSGI request, the body is a sync iterator
+        with mock.patch("chat_app.views.TRANSCRIPT_CHUNK_SIZE", 2):
+            response = self.client.get(self.url, headers=self.headers)
+            chunks = list(response.streaming_content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(chunks), 3)
+        lines = [json.loads(line) for line in b"".join(chunks).splitlines()]
+        self.assertEqual([line["id"] for line in lines], [m.id for m in self.messages])
+
+    async def test_empty_thread(self):
+        await Message.objects.all().adelete()
+
+        response, content = await self.download()
+        self.assertEqual(content, "")
+        response, content = await self.download({"output": "csv"})
+        self.assertEqual(content.count("\n"), 1)
+
+    async def test_invalid_requests(self):
+        response, _ = await self.download({"output": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        headers = {"Authorization": f"Bearer {SlidingToken.for_user(self.user3)}"}
+        response, _ = await self.download(headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
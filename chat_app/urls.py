@@ -4,6 +4,10 @@ from rest_framework_simplejwt.views import TokenObtainSlidingView
 from chat_app.views import (
     ThreadViewSet,
     ThreadMessageViewSet,
+    MessageSearchViewSet,
+    poll_thread_messages,
+    thread_transcript,
+    metrics,
 )
 
 
@@ -14,6 +18,11 @@ urlpatterns = [
         ThreadViewSet.as_view({"post": "create", "get": "list"}),
         name="threads",
     ),
+    path(
+        "api/threads/inbox/",
+        ThreadViewSet.as_view({"get": "inbox"}),
+        name="inbox",
+    ),
     path(
         "api/threads/<int:pk>/",
         ThreadViewSet.as_view({"delete": "destroy"}),
@@ -29,9 +38,35 @@ urlpatterns = [
         ThreadMessageViewSet.as_view({"patch": "partial_update"}),
         name="messages",
     ),
+    path(
+        "api/threads/<int:thread_pk>/messages/poll/",
+        poll_thread_messages,
+        name="poll_messages",
+    ),
+    path(
+        "api/threads/<int:thread_pk>/messages/transcript/",
+        thread_transcript,
+        name="transcript",
+    ),
+    path(
+        "api/threads/<int:thread_pk>/messages/batch/",
+        ThreadMessageViewSet.as_view({"post": "batch"}),
+        name="batch_messages",
+    ),
+    path(
+        "api/threads/<int:thread_pk>/messages/mark_read/",
+        ThreadMessageViewSet.as_view({"post": "mark_read"}),
+        name="mark_read",
+    ),
     path(
         "api/threads/<int:thread_pk>/messages/unread_count/",
         ThreadMessageViewSet.as_view({"get": "unread_count"}),
         name="unread_count",
     ),
+    path(
+        "api/messages/search/",
+        MessageSearchViewSet.as_view({"get": "list"}),
+        name="search_messages",
+    ),
+    path("api/metrics/", metrics, name="metrics"),
 ]
@@ -1,10 +1,43 @@
-from django.http import JsonResponse
-from rest_framework import viewsets, status
-from rest_framework.decorators import action
+import asyncio
+import csv
+import io
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
+from rest_framework import mixins, viewsets, status
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
-from chat_app.models import Thread, Message
-from chat_app.serializers import ThreadSerializer, ThreadMessageSerializer
+from chat_app import cache, events, search
+from chat_app.authentication import authenticate_request
+from chat_app.metrics import registry
+from chat_app.models import Thread, Message, UnreadCounter
+from chat_app.pagination import KeysetPagination, ThreadKeysetPagination
+from chat_app.serializers import (
+    ThreadSerializer,
+    ThreadMessageSerializer,
+    InboxThreadSerializer,
+    MarkThreadReadSerializer,
+    MessageBatchSerializer,
+    MessageRowSerializer,
+    MessageSearchResultSerializer,
+)
 
 
 def custom_404(request, exception=None):
@@ -18,8 +51,89 @@ def custom_404(request, exception=None):
     )
 
 
-class ThreadViewSet(viewsets.ModelViewSet):
+class KeysetPaginationMixin:
+    # LimitOffsetPagination stays the default to keep existing clients working,
+    # keyset pagination is enabled per request with "?pagination=cursor"
+    keyset_pagination_class = KeysetPagination
+    # Actions whose queryset can be paged by KeysetPagination.ordering
+    keyset_actions = ("list",)
+
+    @property
+    def paginator(self):
+        if (
+            not hasattr(self, "_paginator")
+            and self.action in self.keyset_actions
+            and self.request.query_params.get("pagination") == "cursor"
+        ):
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
+
+
+class ReadDatabaseMixin:
+    # Actions that only read are served from settings.CHAT_READ_DATABASE, e.g. a
+    # read-only SQLite connection that does not contend with message inserts
+    read_actions = ("list",)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in self.read_actions:
+            queryset = queryset.using(settings.CHAT_READ_DATABASE)
+        return queryset
+
+
+class CachedListMixin:
+    # The list response data is cached per user, keyed by its ETag: a digest of the
+    # request URL and of the versions returned by get_list_versions(), see
+    # chat_app.cache. A client that sends the ETag back in If-None-Match (or the
+    # Last-Modified time, if there is one, in If-Modified-Since) gets a 304 before the
+    # list query and serialization.
+
+    def get_list_versions(self):
+        """Return (versions, last_modified) of the list, or None to skip the cache."""
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        list_versions = self.get_list_versions()
+        if list_versions is None:
+            return super().list(request, *args, **kwargs)
+
+        versions, last_modified = list_versions
+        etag = cache.response_etag(request, versions)
+        response = self.get_not_modified_response(etag, last_modified)
+        if response is None:
+            data = cache.get_page(etag)
+            if data is None:
+                response = super().list(request, *args, **kwargs)
+                cache.set_page(etag, response.data)
+            else:
+                response = Response(data)
+        return self.add_validators(response, etag, last_modified)
+
+    def get_not_modified_response(self, etag, last_modified):
+        # Returns None when the client's copy is outdated
+        return get_conditional_response(
+            self.request,
+            etag=quote_etag(etag),
+            last_modified=last_modified and int(last_modified.timestamp()),
+        )
+
+    def add_validators(self, response, etag, last_modified):
+        response["ETag"] = quote_etag(etag)
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        # Responses differ per user, shared caches must not store them
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["Authorization"])
+        return response
+
+
+class ThreadViewSet(
+    CachedListMixin, ReadDatabaseMixin, KeysetPaginationMixin, viewsets.ModelViewSet
+):
     serializer_class = ThreadSerializer
+    keyset_pagination_class = ThreadKeysetPagination
+    keyset_actions = ("list", "inbox")
+    read_actions = ("list", "inbox")
 
     # Same situation as in below class
     def get_queryset(self):
@@ -27,6 +141,52 @@ class ThreadViewSet(viewsets.ModelViewSet):
             participants=self.request.user
         )
 
+    def get_list_versions(self):
+        # One aggregate over the user's threads, read from the database so every worker
+        # sees the same versions. It changes when a thread is created or deleted, gets a
+        # message or changes participants. A deletion leaves no newer time behind, so
+        # there is no Last-Modified.
+        versions = (
+            Thread.objects.using(settings.CHAT_READ_DATABASE)
+            .filter(participants=self.request.user)
+            .aggregate(
+                count=Count("id"),
+                id_sum=Sum("id"),
+                last_message_at=Max("last_message_at"),
+                updated=Max("updated"),
+            )
+        )
+        return list(versions.values()), None
+
+    def get_serializer_class(self):
+        if self.action == "inbox":
+            return InboxThreadSerializer
+        return super().get_serializer_class()
+
+    @action(detail=False, methods=["get"])
+    def inbox(self, request):
+        # Everything needed to render the inbox in a constant number of queries: the page
+        # of threads joined with their last message and annotated with the user's
+        # unread counter, and the participants of the page
+        unread_counter = UnreadCounter.objects.filter(
+            thread=OuterRef("pk"), user=request.user
+        )
+        queryset = (
+            self.filter_queryset(self.get_queryset())
+            .select_related("last_message__sender")
+            .annotate(
+                unread_count=Coalesce(Subquery(unread_counter.values("count")[:1]), 0)
+            )
+        )
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
     def create(self, request, *args, **kwargs):
         # Override this method to return status code 200 instead of 201 in case the thread is existing
         serializer = self.get_serializer(data=request.data)
@@ -41,8 +201,17 @@ class ThreadViewSet(viewsets.ModelViewSet):
         )
         return Response(serializer.data, status=status_code, headers=headers)
 
+    def perform_destroy(self, instance):
+        # Participants are prefetched by get_queryset()
+        user_ids = [user.id for user in instance.participants.all()]
+        thread_id = instance.id
+        instance.delete()
+        events.notify_thread_deleted(thread_id, user_ids)
 
-class ThreadMessageViewSet(viewsets.ModelViewSet):
+
+class ThreadMessageViewSet(
+    CachedListMixin, ReadDatabaseMixin, KeysetPaginationMixin, viewsets.ModelViewSet
+):
     serializer_class = ThreadMessageSerializer
 
     # Use select_related because we use 'sender' field in serializer, and with simple filter() we will
@@ -50,15 +219,108 @@ class ThreadMessageViewSet(viewsets.ModelViewSet):
     # and this will make N+1 requests quantity problem
     def get_queryset(self):
         thread_id = self.kwargs.get("thread_pk")
-        return Message.objects.select_related("sender").filter(
+        queryset = Message.objects.filter(
             thread_id=thread_id, thread__participants=self.request.user
         )
+        if self.action == "list":
+            # Only the columns of the response, rendered by MessageRowSerializer
+            return queryset.values(*MessageRowSerializer.values_fields)
+        return queryset.select_related("sender")
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return MessageRowSerializer
+        if self.action == "batch":
+            return MessageBatchSerializer
+        return super().get_serializer_class()
+
+    def get_thread_state(self):
+        """
+        Return the columns of the thread that change whenever its messages do, with the
+        request user's unread count, or None if the user is not a participant.
+
+        A single query, cached for the request. The last message alone would miss a
+        message committed late by a concurrent request (see Message.save()), every new
+        message increments the sum of the unread counters though.
+        """
+        if not hasattr(self, "_thread_state"):
+            counters = UnreadCounter.objects.filter(thread=OuterRef("pk"))
+            self._thread_state = (
+                Thread.objects.using(settings.CHAT_READ_DATABASE)
+                .filter(
+                    pk=self.kwargs.get("thread_pk"),
+                    unread_counters__user=self.request.user,
+                )
+                .annotate(
+                    unread_count=F("unread_counters__count"),
+                    unread_total=Subquery(
+                        counters.values("thread")
+                        .annotate(total=Sum("count"))
+                        .values("total")
+                    ),
+                )
+                .values(
+                    "last_message_id",
+                    "last_message_at",
+                    "read_version",
+                    "read_at",
+                    "unread_count",
+                    "unread_total",
+                )
+                .first()
+            )
+        return self._thread_state
+
+    def get_thread_validators(self):
+        """Return (versions, last_modified) of the thread state, or None."""
+        state = self.get_thread_state()
+        if state is None:
+            return None
+        versions = [
+            state["last_message_id"],
+            state["read_version"],
+            state["unread_total"],
+        ]
+        last_modified = max(filter(None, [state["last_message_at"], state["read_at"]]))
+        # HTTP dates have whole seconds, so If-Modified-Since cannot tell a change from
+        # a later one in the same second. The time is only a validator once its second
+        # is over, until then the ETag alone is.
+        if last_modified >= timezone.now().replace(microsecond=0):
+            last_modified = None
+        return versions, last_modified
+
+    def get_list_versions(self):
+        return self.get_thread_validators()
+
+    def create(self, request, *args, **kwargs):
+        # Return status code 200 instead of 201 for a retried message with a known
+        # client_id
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+
+        headers = self.get_success_headers(serializer.data)
+        status_code = (
+            status.HTTP_200_OK
+            if getattr(serializer, "_existing_message", False)
+            else status.HTTP_201_CREATED
+        )
+        return Response(serializer.data, status=status_code, headers=headers)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context["thread_id"] = self.kwargs.get("thread_pk")
+        if getattr(self, "_participant_checked", False):
+            context["sender_is_participant"] = True
         return context
 
+    def get_object(self):
+        # The queryset only contains messages of the user's threads, so a found
+        # message already proves the participation checked by the serializer
+        obj = super().get_object()
+        self._participant_checked = True
+        return obj
+
     def partial_update(self, request, *args, **kwargs):
         if set(request.data.keys()) - {"is_read"}:
             return Response(
@@ -68,13 +330,80 @@ class ThreadMessageViewSet(viewsets.ModelViewSet):
 
         return super().partial_update(request, *args, **kwargs)
 
+    @action(detail=False, methods=["post"])
+    def batch(self, request, thread_pk=None):
+        # Many messages in one request and one INSERT, e.g. from a client that was
+        # offline. The response lists the messages in the order of the request.
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        messages = serializer.save()
+
+        status_code = (
+            status.HTTP_201_CREATED if serializer._created_count else status.HTTP_200_OK
+        )
+        data = ThreadMessageSerializer(
+            messages, many=True, context=self.get_serializer_context()
+        ).data
+        return Response(data, status=status_code)
+
+    @action(detail=False, methods=["post"])
+    def mark_read(self, request, thread_pk=None):
+        # Marks all messages of the other participant up to the given message id and/or
+        # timestamp as read with a single UPDATE instead of one PATCH per message
+        serializer = MarkThreadReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        with transaction.atomic():
+            # The counter row is the participation check, locking it also serializes
+            # concurrent bulk reads of the same user
+            try:
+                counter = UnreadCounter.objects.select_for_update().get(
+                    thread_id=thread_pk, user=request.user
+                )
+            except UnreadCounter.DoesNotExist:
+                return Response(
+                    {
+                        "detail": "You are not a participant of this thread or the thread does not exist."
+                    },
+                    status=status.HTTP_403_FORBIDDEN,
+                )
+
+            messages = Message.objects.filter(
+                thread_id=thread_pk, is_read=False
+            ).exclude(sender=request.user)
+            if "up_to_id" in serializer.validated_data:
+                messages = messages.filter(
+                    id__lte=serializer.validated_data["up_to_id"]
+                )
+            if "up_to" in serializer.validated_data:
+                up_to = serializer.validated_data["up_to"]
+                if up_to.microsecond:
+                    messages = messages.filter(created__lte=up_to)
+                else:
+                    # The API outputs whole seconds (DATETIME_FORMAT), a time without a
+                    # fraction covers all messages of that second
+                    messages = messages.filter(created__lt=up_to + timedelta(seconds=1))
+
+            marked = messages.update(is_read=True)
+            if marked:
+                UnreadCounter.objects.filter(pk=counter.pk).decrement(marked)
+                Thread.objects.record_read(thread_pk)
+                events.notify_messages_read(
+                    thread_pk, request.user.id, **serializer.data
+                )
+
+        return Response(
+            {"marked": marked, "unread_count": max(counter.count - marked, 0)},
+            status=status.HTTP_200_OK,
+        )
+
     @action(detail=True, methods=["get"])
     def unread_count(self, request, thread_pk=None):
-        user = request.user
-
-        try:
-            thread = Thread.objects.get(id=thread_pk, participants=user)
-        except Thread.DoesNotExist:
+        # Counters are maintained on message creation and read, so the count is part of
+        # the thread state query, which also returns the validators of the response.
+        # Only participants have a counter.
+        validators = self.get_thread_validators()
+        if validators is None:
             return Response(
                 {
                     "detail": "You are not a participant of this thread or the thread does not exist."
@@ -82,13 +411,271 @@ class ThreadMessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        unread_count = (
-            Message.objects.filter(
-                thread_id=thread_pk,
-                is_read=False,
+        versions, last_modified = validators
+        etag = cache.response_etag(request, versions)
+        response = self.get_not_modified_response(etag, last_modified)
+        if response is None:
+            response = Response(
+                {"unread_count": self.get_thread_state()["unread_count"]},
+                status=status.HTTP_200_OK,
             )
-            .exclude(sender=user)
-            .count()
+        return self.add_validators(response, etag, last_modified)
+
+
+class MessageSearchViewSet(
+    ReadDatabaseMixin, mixins.ListModelMixin, viewsets.GenericViewSet
+):
+    # Full-text search over the messages of the user's threads, best matches first,
+    # see chat_app.search for the index
+    serializer_class = MessageSearchResultSerializer
+    # Parsed from the "thread" parameter by list()
+    thread_id = None
+
+    def get_queryset(self):
+        queryset = Message.objects.filter(thread__participants=self.request.user)
+        if self.thread_id is not None:
+            queryset = queryset.filter(thread_id=self.thread_id)
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return (
+            search.search_messages(
+                queryset,
+                self.request.query_params["q"],
+                connections[queryset.db].vendor,
+            )
+            .order_by("-rank", "-created", "-id")
+            .values(*MessageSearchResultSerializer.values_fields)
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get("q", "").strip():
+            return Response(
+                {"detail": "The 'q' parameter is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if "thread" in request.query_params:
+            try:
+                self.thread_id = int(request.query_params["thread"])
+            except ValueError:
+                return Response(
+                    {"detail": "'thread' must be a thread id."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        return super().list(request, *args, **kwargs)
+
+
+LONG_POLL_DEFAULT_TIMEOUT = 25
+LONG_POLL_MAX_TIMEOUT = 60
+LONG_POLL_MAX_MESSAGES = 100
+
+
+def _messages_since(thread_id, since_id):
+    messages = (
+        Message.objects.select_related("sender")
+        .filter(thread_id=thread_id, id__gt=since_id)
+        .order_by("created", "id")[:LONG_POLL_MAX_MESSAGES]
+    )
+    return ThreadMessageSerializer(messages, many=True).data
+
+
+@require_GET
+async def poll_thread_messages(request, thread_pk):
+    # Long polling for clients that cannot use the WebSocket: the request is held until
+    # a message newer than "since_id" is posted to the thread or "timeout" seconds pass.
+    # Waiting costs no queries, the view is woken up by the message.created event.
+    user = await sync_to_async(authenticate_request)(request)
+    if user is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+
+    try:
+        since_id = int(request.GET["since_id"])
+        timeout = float(request.GET.get("timeout", LONG_POLL_DEFAULT_TIMEOUT))
+    except (KeyError, ValueError):
+        return JsonResponse(
+            {"detail": "'since_id' must be an integer and 'timeout' a number."},
+            status=400,
+        )
+    timeout = min(max(timeout, 0), LONG_POLL_MAX_TIMEOUT)
+
+    if not await UnreadCounter.objects.filter(thread_id=thread_pk, user=user).aexists():
+        return JsonResponse(
+            {
+                "detail": "You are not a participant of this thread or the thread does not exist."
+            },
+            status=403,
         )
 
-        return Response({"unread_count": unread_count}, status=status.HTTP_200_OK)
+    # Subscribe before the first read, so a message posted in between still wakes us up
+    subscription = events.get_broker().subscribe([events.user_topic(user.id)])
+    try:
+        messages = await sync_to_async(_messages_since)(thread_pk, since_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not messages:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(subscription.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if event["type"] == "message.created" and event["thread_id"] == thread_pk:
+                messages = await sync_to_async(_messages_since)(thread_pk, since_id)
+    finally:
+        subscription.close()
+
+    return JsonResponse({"results": messages})
+
+
+TRANSCRIPT_CHUNK_SIZE = 2000
+TRANSCRIPT_CSV_HEADER = [
+    "id",
+    "sender_id",
+    "sender_username",
+    "text",
+    "is_read",
+    "created",
+]
+
+
+def _transcript_page(thread_id, after):
+    # Messages after the (created, id) of the last message of the previous page, oldest
+    # first. Short keyset queries instead of one cursor open for the whole download.
+    messages = Message.objects.using(settings.CHAT_READ_DATABASE).filter(
+        thread_id=thread_id
+    )
+    if after is not None:
+        created, message_id = after
+        messages = messages.filter(
+            Q(created__gt=created) | Q(created=created, id__gt=message_id)
+        )
+    return list(
+        messages.order_by("created", "id").values(*MessageRowSerializer.values_fields)[
+            :TRANSCRIPT_CHUNK_SIZE
+        ]
+    )
+
+
+def _render_ndjson(messages):
+    renderer = JSONRenderer()
+    return b"".join(renderer.render(message) + b"\n" for message in messages)
+
+
+def _write_csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def _csv_text(value):
+    # Spreadsheets run cells starting with these as formulas, the quote keeps them text
+    if value.startswith(("=", "+", "-", "@", "\t", "\r")):
+        return f"'{value}"
+    return value
+
+
+def _render_csv(messages):
+    return _write_csv(
+        [
+            message["id"],
+            message["sender"]["id"],
+            _csv_text(message["sender"]["username"]),
+            _csv_text(message["text"]),
+            message["is_read"],
+            message["created"],
+        ]
+        for message in messages
+    )
+
+
+# Content type, renderer of a page of messages and the first line of the file
+TRANSCRIPT_OUTPUTS = {
+    "ndjson": ("application/x-ndjson", _render_ndjson, b""),
+    "csv": (
+        "text/csv; charset=utf-8",
+        _render_csv,
+        _write_csv([TRANSCRIPT_CSV_HEADER]),
+    ),
+}
+
+
+async def _stream_transcript(thread_id, render, header):
+    # Only one page of messages is held at a time, so the memory use does not grow
+    # with the thread. The pages are read in the thread of the sync views.
+    if header:
+        yield header
+    serializer = MessageRowSerializer()
+    after = None
+    while True:
+        rows = await sync_to_async(_transcript_page)(thread_id, after)
+        if not rows:
+            break
+        yield render([serializer.to_representation(row) for row in rows])
+        after = rows[-1]["created"], rows[-1]["id"]
+
+
+def _iter_transcript(thread_id, render, header):
+    # The same pages for WSGI servers, which buffer the whole body of an async
+    # iterator before sending it
+    if header:
+        yield header
+    serializer = MessageRowSerializer()
+    after = None
+    while True:
+        rows = _transcript_page(thread_id, after)
+        if not rows:
+            break
+        yield render([serializer.to_representation(row) for row in rows])
+        after = rows[-1]["created"], rows[-1]["id"]
+
+
+@require_GET
+async def thread_transcript(request, thread_pk):
+    # The whole thread in one download, as NDJSON (the message list format, one message
+    # per line) or CSV with "?output=csv", oldest message first
+    user = await sync_to_async(authenticate_request)(request)
+    if user is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+
+    output = request.GET.get("output", "ndjson")
+    if output not in TRANSCRIPT_OUTPUTS:
+        return JsonResponse(
+            {"detail": "'output' must be 'ndjson' or 'csv'."},
+            status=400,
+        )
+
+    if not await UnreadCounter.objects.filter(thread_id=thread_pk, user=user).aexists():
+        return JsonResponse(
+            {
+                "detail": "You are not a participant of this thread or the thread does not exist."
+            },
+            status=403,
+        )
+
+    content_type, render, header = TRANSCRIPT_OUTPUTS[output]
+    stream = (
+        _stream_transcript if isinstance(request, ASGIRequest) else _iter_transcript
+    )
+    response = StreamingHttpResponse(
+        stream(thread_pk, render, header), content_type=content_type
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="thread-{thread_pk}.{output}"'
+    )
+    return response
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    # Per-route request metrics of this process in the Prometheus text format, recorded
+    # by MetricsMiddleware when CHAT_METRICS_ENABLED is set
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,92 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+
+from chat_app.authentication import authenticate_token
+from chat_app.events import get_broker, user_topic
+
+WEBSOCKET_PATH = "/ws/chat/"
+
+# Close codes in the 4000-4999 range are free for applications
+CLOSE_NOT_FOUND = 4404
+CLOSE_UNAUTHORIZED = 4401
+
+
+def _authenticate(raw_token):
+    # Runs in a worker thread outside of the request cycle, so clean up the
+    # database connection the same way Django does around requests
+    close_old_connections()
+    try:
+        return authenticate_token(raw_token)
+    finally:
+        close_old_connections()
+
+
+async def chat_websocket(scope, receive, send):
+    """
+    ASGI application pushing chat events of the authenticated user.
+
+    Clients connect to /ws/chat/?token=<sliding token> and receive JSON events:
+    "message.created", "messages.read" and "unread_count" for all of their threads.
+    A {"type": "ping"} message is answered with {"type": "pong"}.
+    """
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+
+    if scope["path"] != WEBSOCKET_PATH:
+        await send({"type": "websocket.close", "code": CLOSE_NOT_FOUND})
+        return
+
+    query = parse_qs(scope.get("query_string", b"").decode())
+    raw_token = query.get("token", [None])[0]
+    user = await sync_to_async(_authenticate)(raw_token) if raw_token else None
+    if user is None:
+        await send({"type": "websocket.close", "code": CLOSE_UNAUTHORIZED})
+        return
+
+    # Subscribe before accepting, so no event is lost between the handshake and the loop
+    subscription = get_broker().subscribe([user_topic(user.id)])
+    await send({"type": "websocket.accept"})
+
+    next_message = asyncio.ensure_future(receive())
+    next_event = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {next_message, next_event}, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if next_event in done:
+                await send(
+                    {
+                        "type": "websocket.send",
+                        "text": json.dumps(next_event.result(), cls=DjangoJSONEncoder),
+                    }
+                )
+                next_event = asyncio.ensure_future(subscription.get())
+
+            if next_message in done:
+                message = next_message.result()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if _is_ping(message):
+                    await send(
+                        {"type": "websocket.send", "text": json.dumps({"type": "pong"})}
+                    )
+                next_message = asyncio.ensure_future(receive())
+    finally:
+        next_message.cancel()
+        next_event.cancel()
+        subscription.close()
+
+
+def _is_ping(message):
+    try:
+        return json.loads(message.get("text") or "{}").get("type") == "ping"
+    except (ValueError, AttributeError):
+        return False
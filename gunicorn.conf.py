@@ -0,0 +1,63 @@
+"""
+Gunicorn configuration of the production server, read from the working directory
+when running `gunicorn` without arguments. Every setting can be changed from the
+environment (or .env).
+"""
+
+import time
+
+# Module-level names are gunicorn settings, and "config" is one of them
+from decouple import config as env
+
+# The ASGI application serves HTTP requests and the WebSocket events
+wsgi_app = "my_django_chat_project.asgi:application"
+worker_class = "uvicorn_worker.UvicornWorker"
+
+bind = env("GUNICORN_BIND", default="0.0.0.0:8000")
+# One worker by default: the default SQLite database, in-memory event broker
+# (CHAT_EVENT_BROKER) and local-memory cache all belong to a single process. Raise it
+# only with PostgreSQL, a shared cache and a broker backed by an external service. An
+# async uvicorn worker serves many concurrent requests, so about one worker per CPU is
+# plenty, not the 2 * CPUs + 1 of sync workers.
+workers = env("WEB_CONCURRENCY", default=1, cast=int)
+
+# Load the application once in the master before forking the workers: faster and
+# smaller workers, but code changes need a full restart instead of a HUP reload
+preload_app = env("GUNICORN_PRELOAD", default=False, cast=bool)
+
+# Seconds to keep an idle HTTP connection open, longer than the idle timeout of a
+# load balancer in front of the server so it never reuses a closed connection
+keepalive = env("GUNICORN_KEEPALIVE", default=75, cast=int)
+# Workers that do not report back for this long are restarted
+timeout = env("GUNICORN_TIMEOUT", default=30, cast=int)
+# On restart or shutdown, requests in flight get this long to finish, open
+# WebSocket connections are closed and clients reconnect
+graceful_timeout = env("GUNICORN_GRACEFUL_TIMEOUT", default=30, cast=int)
+# Restart workers after a number of requests (with jitter, so they do not all
+# restart at once) to bound the memory growth of long-running processes
+max_requests = env("GUNICORN_MAX_REQUESTS", default=10_000, cast=int)
+max_requests_jitter = env("GUNICORN_MAX_REQUESTS_JITTER", default=1000, cast=int)
+
+forwarded_allow_ips = env("FORWARDED_ALLOW_IPS", default="127.0.0.1")
+accesslog = env("GUNICORN_ACCESS_LOG", default="-")
+loglevel = env("GUNICORN_LOG_LEVEL", default="info")
+
+# Startup time, measured from loading this file in the master process, see
+# when_ready and post_worker_init in the log
+started = time.monotonic()
+
+
+def when_ready(server):
+    server.log.info("Server ready in %.2fs", time.monotonic() - started)
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    worker.log.info(
+        "Worker %s loaded the application in %.2fs",
+        worker.pid,
+        time.monotonic() - worker.forked_at,
+    )